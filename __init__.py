@@ -6,9 +6,9 @@ __all__ = [
     'models', 
     'Bean', 'Chatter', 'Publisher', "TrendingBean", "AggregatedBean", 
     'Beansack', 'DuckSack', 'LanceSack', 'PGSack',
-    'SimpleVectorDB', 'AsyncCDNStore',
+    'SimpleVectorDB', 'NearDuplicateGate', 'EmbeddingCache', 'Suggestion', 'Estimate', 'AsyncCDNStore', 'LocalCDNStore', 'AsyncLocalCDNStore',
     "create_client", "create_db",
-    "BEANS", "PUBLISHERS", "CHATTERS", "RELATED_BEANS", "DATETIME"
+    "BEANS", "PUBLISHERS", "CHATTERS", "RELATED_BEANS", "EMBEDDINGS", "DATETIME"
 ] 
 
 from typing import Literal
@@ -1,46 +1,120 @@
+import gzip
+import hashlib
+import inspect
+import json
 import mimetypes
 import os
+import shutil
+import time
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 import asyncio
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Callable, Iterable, Literal, NamedTuple
 import boto3
 import aioboto3
 from botocore.client import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+import numpy as np
+from tenacity import AsyncRetrying, retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random_exponential
 
 _CONFIG = Config(s3={'addressing_style': 'virtual'})
 _MAX_CONCURRENCY = 100
+PART_SIZE = int(os.getenv("S3_PART_SIZE", 8 << 20)) # S3 requires at least 5MB for every part but the last
+PART_CONCURRENCY = 4 # parts of a single stream uploaded at once
+RETRY_COUNT = 3
+HASH_METADATA = "content-hash" # stored as x-amz-meta-content-hash
+COMPRESSION = Literal["gzip", "br", "zstd"] # Content-Encoding values. br needs brotli and zstd needs zstandard installed
+COMPRESSION_THRESHOLD = int(os.getenv("CDN_COMPRESSION_THRESHOLD", 1024)) # smaller texts are not worth the decompression on the client
+MAX_IN_FLIGHT = 64 # uploads (and contents held in memory) of a pipeline
+_TRANSIENT_CODES = {"500", "502", "503", "504", "InternalError", "ServiceUnavailable", "SlowDown", "RequestTimeout", "RequestTimeTooSkewed", "Throttling", "ThrottlingException"}
+_compress_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="cdncompress")
 
 def _guess_type(file_path: str) -> str:
     content_type, _ = mimetypes.guess_type(file_path)
     return content_type or 'application/octet-stream'
 
 class CDNStore:
-    def __init__(self, bucket: str, public_access_url: str = None):
+    def __init__(self, bucket: str, public_access_url: str = None, manifest_path: str = None, compression: COMPRESSION = None, compression_threshold: int = COMPRESSION_THRESHOLD):
+        """
+        Parameters:
+            bucket: bucket name with or without the s3:// prefix.
+            public_access_url: base url the uploaded keys are served from.
+            manifest_path: optional local json file of key -> content hash used to skip unchanged uploads without asking the bucket.
+            compression: optional Content-Encoding applied to text uploads of at least `compression_threshold` bytes.
+        """
         self.bucket = bucket.removeprefix("s3://").removesuffix("/")
-        self.s3_client = boto3.client(
+        self.s3_client = self._create_client()
+        # self.endpoint_url = os.getenv("S3_ENDPOINT")
+        self.public_url = public_access_url.rstrip("/") if public_access_url else None
+        self.manifest_path = manifest_path
+        self.manifest = _load_manifest(manifest_path)
+        self.stats = {"uploaded": 0, "skipped": 0}
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._compress = _compressor(compression)
+
+    def _create_client(self):
+        return boto3.client(
             's3',
             aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
             aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
             region_name=os.getenv("S3_REGION"),
             endpoint_url=os.getenv("S3_ENDPOINT")
-        )        
-        # self.endpoint_url = os.getenv("S3_ENDPOINT")
-        self.public_url = public_access_url.rstrip("/") if public_access_url else None
+        )
 
-    def upload_text(self, path: str, content: str) -> str:
+    def upload_text(self, path: str, content: str, skip_unchanged: bool = False) -> str:
         """Uploads a single text file.
 
         Parameters:
             path: should be in the format 'folder/file_name.ext'.
             content: is the text content to be uploaded.
+            skip_unchanged: if True, the upload is skipped when the stored object has the same content hash.
         """
+        body = content.encode('utf-8')
+        compressed = self._compress and len(body) >= self.compression_threshold
+        digest = _text_digest(body, self.compression if compressed else None)
+        if skip_unchanged and self._unchanged(path, digest): 
+            self.stats["skipped"] += 1
+            return _public_url(self.public_url, path)
+
+        encoding = {}
+        if compressed: body, encoding = self._compress(body), {"ContentEncoding": self.compression}
         self.s3_client.put_object(
             Bucket=self.bucket, 
             Key=path, 
-            Body=content.encode('utf-8'), 
-            ContentType=_guess_type(path)
+            Body=body, 
+            ContentType=_guess_type(path),
+            Metadata={HASH_METADATA: digest},
+            **encoding
         )
+        self.stats["uploaded"] += 1
+        if self.manifest is not None: self.manifest[path] = digest
         return _public_url(self.public_url, path)
 
+    def _unchanged(self, path: str, digest: str) -> bool:
+        if self.manifest is not None and path in self.manifest: return self.manifest[path] == digest
+        try: stored = _stored_hash(self.s3_client.head_object(Bucket=self.bucket, Key=path))
+        except ClientError as e:
+            if _not_found(e): return False
+            raise
+        if stored == digest and self.manifest is not None: self.manifest[path] = digest
+        return stored == digest
+
+    def save_manifest(self):
+        """Writes the manifest back to `manifest_path`."""
+        _save_manifest(self.manifest_path, self.manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Saves the manifest. The store stays usable."""
+        self.save_manifest()
+
     def upload_binary(self, path: str, data: bytes) -> str:
         """Uploads a single binary file.
 
@@ -54,8 +128,51 @@ class CDNStore:
             Body=data, 
             ContentType=_guess_type(path)
         )
+        # the object no longer has the content hash recorded for a text upload
+        if self.manifest is not None: self.manifest.pop(path, None)
+        return _public_url(self.public_url, path)
+
+    def upload_stream(self, path: str, stream: BinaryIO|Iterable[bytes], part_size: int = PART_SIZE, max_concurrency: int = PART_CONCURRENCY) -> str:
+        """Uploads a file-like object or an iterable of byte chunks without holding it in memory.
+        Content larger than one part is sent as a multipart upload with up to `max_concurrency` parts in flight, 
+        each part retried on failure. The upload is aborted if a part keeps failing.
+
+        Parameters:
+            path: should be in the format 'folder/file_name.ext'.
+            stream: binary file-like object or iterable of bytes.
+            part_size: size of each part in bytes (at least 5MB).
+            max_concurrency: number of parts uploaded concurrently.
+        """
+        parts = _read_parts(stream, part_size)
+        first, second = next(parts, b""), next(parts, None)
+        if second is None: return self.upload_binary(path, first)
+
+        upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=path, ContentType=_guess_type(path))["UploadId"]
+        try:
+            uploaded, pending = [], set()
+            with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="cdnpart") as executor:
+                for number, part in enumerate(_prepend(parts, first, second), start=1):
+                    # keep at most max_concurrency parts read into memory
+                    if len(pending) >= max_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        uploaded.extend(future.result() for future in done)
+                    pending.add(executor.submit(self._upload_part, path, upload_id, number, part))
+                uploaded.extend(future.result() for future in pending)
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=path, UploadId=upload_id, 
+                MultipartUpload={"Parts": sorted(uploaded, key=lambda part: part["PartNumber"])}
+            )
+        except BaseException:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=path, UploadId=upload_id)
+            raise
+        if self.manifest is not None: self.manifest.pop(path, None)
         return _public_url(self.public_url, path)
 
+    @retry(stop=stop_after_attempt(RETRY_COUNT), wait=wait_exponential(max=10), reraise=True)
+    def _upload_part(self, path: str, upload_id: str, number: int, data: bytes) -> dict:
+        response = self.s3_client.upload_part(Bucket=self.bucket, Key=path, UploadId=upload_id, PartNumber=number, Body=data)
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
     # async def batch_upload_texts(self, data: list[dict]) -> dict[str, str]:
     #     """Uploads multiple text items concurrently. 
     #     Parameters:
@@ -68,7 +185,20 @@ class CDNStore:
 
 
 class AsyncCDNStore:
-    def __init__(self, bucket: str, public_access_url: str = None, max_concurrency: int = _MAX_CONCURRENCY):
+    """Async uploader that keeps one S3 client (and its connection pool) open across calls.
+    The client is opened on first use or on `async with`, and released by `close()` or on exiting the context."""
+    def __init__(self, bucket: str, public_access_url: str = None, max_concurrency: int = _MAX_CONCURRENCY, max_pool_connections: int = None, manifest_path: str = None, compression: COMPRESSION = None, compression_threshold: int = COMPRESSION_THRESHOLD):
+        """
+        Parameters:
+            bucket: bucket name with or without the s3:// prefix.
+            public_access_url: base url the uploaded keys are served from.
+            max_concurrency: maximum number of uploads in flight.
+            max_pool_connections: size of the client's http connection pool. Defaults to `max_concurrency` so that no upload waits on a connection.
+            manifest_path: optional local json file of key -> content hash used to skip unchanged uploads without asking the bucket.
+                It is written back on `close()`.
+            compression: optional Content-Encoding applied to text uploads of at least `compression_threshold` bytes. 
+                Compression runs in a thread pool so that large batches do not stall the event loop.
+        """
         self.bucket = bucket.removeprefix("s3://").removesuffix("/")
         self.session = aioboto3.Session(
             aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
@@ -78,26 +208,83 @@ class AsyncCDNStore:
         self.endpoint_url = os.getenv("S3_ENDPOINT")
         self.public_url = public_access_url.rstrip("/") if public_access_url else None
         self.throttle = asyncio.Semaphore(max_concurrency) 
+        self.config = _CONFIG.merge(Config(max_pool_connections=max_pool_connections or max_concurrency))
+        self._client_context = None
+        self._s3_client = None
+        self._client_lock = asyncio.Lock()
+        self.manifest_path = manifest_path
+        self.manifest = _load_manifest(manifest_path)
+        self.stats = {"uploaded": 0, "skipped": 0}
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._compress = _compressor(compression)
 
-    async def _upload(self, s3_client, key: str, content: bytes) -> str:
+    async def __aenter__(self):
+        await self._client()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _client(self):
+        """Returns the shared client, opening it on first use."""
+        if self._s3_client: return self._s3_client
+        async with self._client_lock:
+            if not self._s3_client:
+                client_context = self.session.client('s3', endpoint_url=self.endpoint_url, config=self.config)
+                self._s3_client = await client_context.__aenter__()
+                self._client_context = client_context
+        return self._s3_client
+
+    async def close(self):
+        """Closes the shared client and its connections and saves the manifest. The next upload opens a new client."""
+        _save_manifest(self.manifest_path, self.manifest)
+        async with self._client_lock:
+            client_context, self._client_context, self._s3_client = self._client_context, None, None
+            if client_context: await client_context.__aexit__(None, None, None)
+
+    async def _upload(self, s3_client, key: str, content: str, skip_unchanged: bool = False) -> str:
+        body = content.encode('utf-8')
+        compressed = self._compress and len(body) >= self.compression_threshold
+        digest = _text_digest(body, self.compression if compressed else None)
         async with self.throttle:
+            if skip_unchanged and await self._unchanged(s3_client, key, digest):
+                self.stats["skipped"] += 1
+                return _public_url(self.public_url, key)
+            encoding = {}
+            if compressed:
+                body = await asyncio.get_running_loop().run_in_executor(_compress_executor, self._compress, body)
+                encoding = {"ContentEncoding": self.compression}
             await s3_client.put_object(
                 Bucket=self.bucket, 
                 Key=key, 
-                Body=content.encode('utf-8'), 
-                ContentType="text/plain; charset=utf-8"
+                Body=body, 
+                ContentType="text/plain; charset=utf-8",
+                Metadata={HASH_METADATA: digest},
+                **encoding
             )
+        self.stats["uploaded"] += 1
+        if self.manifest is not None: self.manifest[key] = digest
         return _public_url(self.public_url, key)
 
-    async def upload_text(self, path: str, content: str) -> str:
+    async def _unchanged(self, s3_client, key: str, digest: str) -> bool:
+        if self.manifest is not None and key in self.manifest: return self.manifest[key] == digest
+        try: stored = _stored_hash(await s3_client.head_object(Bucket=self.bucket, Key=key))
+        except ClientError as e:
+            if _not_found(e): return False
+            raise
+        if stored == digest and self.manifest is not None: self.manifest[key] = digest
+        return stored == digest
+
+    async def upload_text(self, path: str, content: str, skip_unchanged: bool = False) -> str:
         """Uploads a single text file.
 
         Parameters:
             path: should be in the format 'folder/file_name.ext'.
             content: is the text content to be uploaded.
+            skip_unchanged: if True, the upload is skipped when the stored object has the same content hash.
         """
-        async with self.session.client('s3', endpoint_url=self.endpoint_url, config=_CONFIG) as s3_client:
-            return await self._upload(s3_client, path, content)
+        return await self._upload(await self._client(), path, content, skip_unchanged)
 
     async def upload_binary(self, path: str, data: bytes) -> str:
         """Uploads a single binary file.
@@ -106,25 +293,364 @@ class AsyncCDNStore:
             path: should be in the format 'folder/file_name.ext'.
             data: is the binary content to be uploaded.
         """
-        async with self.session.client('s3', endpoint_url=self.endpoint_url, config=_CONFIG) as s3_client:
-            async with self.throttle:
-                await s3_client.put_object(
-                    Bucket=self.bucket, 
-                    Key=path, 
-                    Body=data, 
-                    ContentType=_guess_type(path)
-                )
+        s3_client = await self._client()
+        async with self.throttle:
+            await s3_client.put_object(
+                Bucket=self.bucket, 
+                Key=path, 
+                Body=data, 
+                ContentType=_guess_type(path)
+            )
+        # the object no longer has the content hash recorded for a text upload
+        if self.manifest is not None: self.manifest.pop(path, None)
         return _public_url(self.public_url, path)
 
-    async def batch_upload_texts(self, data: list[dict]) -> dict[str, str]:
+    async def upload_stream(self, path: str, stream: BinaryIO|Iterable[bytes]|AsyncIterable[bytes], part_size: int = PART_SIZE, max_concurrency: int = PART_CONCURRENCY) -> str:
+        """Uploads a file-like object (sync or async `read`), an iterable or an async iterable of byte chunks without holding it in memory.
+        Content larger than one part is sent as a multipart upload with up to `max_concurrency` parts in flight, 
+        each part retried on failure. The upload is aborted if a part keeps failing.
+
+        Parameters:
+            path: should be in the format 'folder/file_name.ext'.
+            stream: binary file-like object, iterable or async iterable of bytes.
+            part_size: size of each part in bytes (at least 5MB).
+            max_concurrency: number of parts uploaded concurrently.
+        """
+        parts = _aread_parts(stream, part_size)
+        first, second = await anext(parts, b""), await anext(parts, None)
+        if second is None: return await self.upload_binary(path, first)
+
+        s3_client = await self._client()
+        upload_id = (await s3_client.create_multipart_upload(Bucket=self.bucket, Key=path, ContentType=_guess_type(path)))["UploadId"]
+        try:
+            uploaded, pending, number = [], set(), 0
+            for part in (first, second):
+                number += 1
+                pending.add(asyncio.create_task(self._upload_part(s3_client, path, upload_id, number, part)))
+            async for part in parts:
+                # keep at most max_concurrency parts read into memory
+                if len(pending) >= max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    uploaded.extend(task.result() for task in done)
+                number += 1
+                pending.add(asyncio.create_task(self._upload_part(s3_client, path, upload_id, number, part)))
+            uploaded.extend(await asyncio.gather(*pending))
+            await s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=path, UploadId=upload_id, 
+                MultipartUpload={"Parts": sorted(uploaded, key=lambda part: part["PartNumber"])}
+            )
+        except BaseException:
+            for task in pending: task.cancel()
+            # parts still in flight would race the abort and leave orphaned parts behind
+            await asyncio.gather(*pending, return_exceptions=True)
+            await s3_client.abort_multipart_upload(Bucket=self.bucket, Key=path, UploadId=upload_id)
+            raise
+        if self.manifest is not None: self.manifest.pop(path, None)
+        return _public_url(self.public_url, path)
+
+    @retry(stop=stop_after_attempt(RETRY_COUNT), wait=wait_exponential(max=10), reraise=True)
+    async def _upload_part(self, s3_client, path: str, upload_id: str, number: int, data: bytes) -> dict:
+        async with self.throttle:
+            response = await s3_client.upload_part(Bucket=self.bucket, Key=path, UploadId=upload_id, PartNumber=number, Body=data)
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def upload_pipeline(self, items: AsyncIterable[tuple[str, str]]|Iterable[tuple[str, str]], max_in_flight: int = MAX_IN_FLIGHT, retries: int = RETRY_COUNT, skip_unchanged: bool = False) -> "UploadPipeline":
+        """Uploads `(path, content)` pairs as they arrive and yields an `UploadResult` per object as soon as it finishes.
+        At most `max_in_flight` items are pulled from `items` and held in memory at a time. Transient failures are retried
+        up to `retries` attempts with jittered exponential backoff; objects that still fail are yielded with their error 
+        instead of stopping the pipeline. Throughput and latency are available from `stats` of the returned pipeline.
+
+            async for result in store.upload_pipeline(pages()):
+                if result.error: ...
+        """
+        return UploadPipeline(self, items, max_in_flight=max_in_flight, retries=retries, skip_unchanged=skip_unchanged)
+
+    async def batch_upload_texts(self, data: list[dict], skip_unchanged: bool = False) -> dict[str, str]:
         """Uploads multiple text items concurrently. 
         Parameters:
             data: A list of dictionaries, each containing 'path' and 'content' keys.
                 'path' should be in the format 'folder/file_name.ext'.
                 'content' is the text content to be uploaded.
+            skip_unchanged: if True, items whose content hash matches the manifest or the stored object are not uploaded. 
+                The uploaded and skipped counts are added to `stats`.
         """
-        async with self.session.client('s3', endpoint_url=self.endpoint_url, config=_CONFIG) as s3:
-            return await asyncio.gather(*(self._upload(s3, item['path'], item['content']) for item in data))
+        s3_client = await self._client()
+        return await asyncio.gather(*(self._upload(s3_client, item['path'], item['content'], skip_unchanged) for item in data))
+
+def _compressor(compression: COMPRESSION) -> Callable[[bytes], bytes]:
+    if not compression: return None
+    # mtime=0 keeps the output deterministic for the same content
+    if compression == "gzip": return lambda body: gzip.compress(body, mtime=0)
+    if compression == "br":
+        import brotli
+        return brotli.compress
+    if compression == "zstd":
+        import zstandard
+        return lambda body: zstandard.ZstdCompressor().compress(body)
+    raise ValueError(f"unsupported compression {compression}")
+
+def _content_hash(body: bytes) -> str:
+    """md5 hex digest, the same as the ETag S3 assigns to single part uploads."""
+    return hashlib.md5(body, usedforsecurity=False).hexdigest()
+
+def _text_digest(body: bytes, encoding: str = None) -> str:
+    """Content hash of a text upload, tagged with the Content-Encoding it is stored with 
+    so that changing the compression of a store re-uploads otherwise unchanged content."""
+    digest = _content_hash(body)
+    return f"{digest}:{encoding}" if encoding else digest
+
+def _stored_hash(head: dict) -> str:
+    return head.get("Metadata", {}).get(HASH_METADATA) or head.get("ETag", "").strip('"')
+
+def _not_found(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+def _load_manifest(manifest_path: str) -> dict[str, str]:
+    if not manifest_path: return None
+    if not os.path.exists(manifest_path): return {}
+    with open(manifest_path) as file: return json.load(file)
+
+def _save_manifest(manifest_path: str, manifest: dict[str, str]):
+    if not manifest_path: return
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path + ".tmp", "w") as file: json.dump(manifest, file)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def _read_parts(stream: BinaryIO|Iterable[bytes], part_size: int) -> Iterable[bytes]:
+    """Re-buffers a file-like object or an iterable of byte chunks into `part_size` parts (the last one may be shorter)."""
+    chunks = iter(lambda: stream.read(part_size), b"") if hasattr(stream, "read") else stream
+    buffer = bytearray()
+    for chunk in chunks:
+        if not buffer and len(chunk) == part_size: 
+            yield chunk
+            continue
+        buffer.extend(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer: yield bytes(buffer)
+
+async def _aread_parts(stream: BinaryIO|Iterable[bytes]|AsyncIterable[bytes], part_size: int) -> AsyncIterable[bytes]:
+    """Async version of `_read_parts` that also accepts async file-like objects and async iterables."""
+    if not hasattr(stream, "read") and not hasattr(stream, "__aiter__"):
+        for part in _read_parts(stream, part_size): yield part
+        return
+
+    buffer = bytearray()
+    async for chunk in _aread_chunks(stream, part_size):
+        if not buffer and len(chunk) == part_size: 
+            yield chunk
+            continue
+        buffer.extend(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer: yield bytes(buffer)
+
+async def _aread_chunks(stream: BinaryIO|AsyncIterable[bytes], size: int) -> AsyncIterable[bytes]:
+    if not hasattr(stream, "read"):
+        async for chunk in stream: yield chunk
+        return
+    # blocking reads of sync file objects go to the file threads so that they do not stall the event loop
+    if inspect.iscoroutinefunction(stream.read): read = lambda: stream.read(size)
+    else: read = lambda: asyncio.get_running_loop().run_in_executor(_file_executor, stream.read, size)
+    while True:
+        chunk = await read()
+        if inspect.isawaitable(chunk): chunk = await chunk
+        if not chunk: return
+        yield chunk
+
+def _prepend(parts: Iterable[bytes], *first: bytes) -> Iterable[bytes]:
+    yield from first
+    yield from parts
+
+class LocalCDNStore(CDNStore):
+    """CDNStore that writes into a local directory (or a mounted volume) instead of a bucket, for offline testing, 
+    benchmarking and small deployments serving from disk. Uploads go through the same code paths as S3 
+    (skip unchanged, compression, multipart) against a client that writes each object to a temporary file and 
+    atomically renames it into place. Object metadata is kept under `root/.cdnmeta`."""
+    def __init__(self, root: str, public_access_url: str = None, manifest_path: str = None, compression: COMPRESSION = None, compression_threshold: int = COMPRESSION_THRESHOLD):
+        super().__init__(root.removeprefix("file://"), public_access_url, manifest_path=manifest_path, compression=compression, compression_threshold=compression_threshold)
+
+    def _create_client(self):
+        return _LocalClient(self.bucket)
+
+class AsyncLocalCDNStore(AsyncCDNStore):
+    """AsyncCDNStore counterpart of `LocalCDNStore`. File I/O runs in a thread pool so that it does not block the event loop."""
+    def __init__(self, root: str, public_access_url: str = None, max_concurrency: int = _MAX_CONCURRENCY, manifest_path: str = None, compression: COMPRESSION = None, compression_threshold: int = COMPRESSION_THRESHOLD):
+        super().__init__(root.removeprefix("file://"), public_access_url, max_concurrency=max_concurrency, manifest_path=manifest_path, compression=compression, compression_threshold=compression_threshold)
+
+    async def _client(self):
+        if not self._s3_client: self._s3_client = _AsyncLocalClient(_LocalClient(self.bucket))
+        return self._s3_client
+
+_META_DIR = ".cdnmeta"
+_file_executor = ThreadPoolExecutor(max_workers=_MAX_CONCURRENCY // 4, thread_name_prefix="cdnfile")
+
+class _LocalClient:
+    """The subset of the boto3 s3 client used by the stores, backed by a directory."""
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, _META_DIR, "uploads"), exist_ok=True)
+
+    def _path(self, key: str, *meta: str) -> str:
+        base = os.path.join(self.root, *meta)
+        path = os.path.abspath(os.path.join(base, key))
+        if not path.startswith(base + os.sep): raise ValueError(f"key {key} points outside of {base}")
+        # object keys must not reach into the metadata and in-progress uploads
+        if not meta and os.path.relpath(path, self.root).split(os.sep)[0] == _META_DIR: raise ValueError(f"key {key} is reserved for {_META_DIR}")
+        return path
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType: str = None, Metadata: dict = None, ContentEncoding: str = None) -> dict:
+        etag = _content_hash(Body)
+        _atomic_write(self._path(Key), Body)
+        meta = {"ETag": f'"{etag}"', "ContentType": ContentType, "ContentLength": len(Body), "Metadata": Metadata or {}}
+        if ContentEncoding: meta["ContentEncoding"] = ContentEncoding
+        _atomic_write(self._path(Key + ".json", _META_DIR), json.dumps(meta).encode("utf-8"))
+        return {"ETag": meta["ETag"]}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        try:
+            with open(self._path(Key + ".json", _META_DIR)) as file: return json.load(file)
+        except FileNotFoundError:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+
+    def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str = None) -> dict:
+        upload_id = os.urandom(16).hex()
+        os.makedirs(self._path(upload_id, _META_DIR, "uploads"))
+        with open(self._path(os.path.join(upload_id, "meta.json"), _META_DIR, "uploads"), "w") as file: json.dump({"ContentType": ContentType}, file)
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes) -> dict:
+        _atomic_write(self._path(os.path.join(UploadId, str(PartNumber)), _META_DIR, "uploads"), Body)
+        return {"ETag": f'"{_content_hash(Body)}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        upload_dir = self._path(UploadId, _META_DIR, "uploads")
+        with open(os.path.join(upload_dir, "meta.json")) as file: content_type = json.load(file)["ContentType"]
+        path, size, digest = self._path(Key), 0, hashlib.md5(usedforsecurity=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{UploadId}.tmp"
+        with open(tmp, "wb") as output:
+            for part in MultipartUpload["Parts"]:
+                with open(os.path.join(upload_dir, str(part["PartNumber"])), "rb") as file: data = file.read()
+                output.write(data)
+                size += len(data)
+                digest.update(data)
+        os.replace(tmp, path)
+        meta = {"ETag": f'"{digest.hexdigest()}-{len(MultipartUpload["Parts"])}"', "ContentType": content_type, "ContentLength": size, "Metadata": {}}
+        _atomic_write(self._path(Key + ".json", _META_DIR), json.dumps(meta).encode("utf-8"))
+        self.abort_multipart_upload(Bucket, Key, UploadId)
+        return {"ETag": meta["ETag"]}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        shutil.rmtree(self._path(UploadId, _META_DIR, "uploads"), ignore_errors=True)
+        return {}
+
+class _AsyncLocalClient:
+    """Runs the calls of a `_LocalClient` in a thread pool."""
+    def __init__(self, client: _LocalClient):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+        async def call(**kwargs): return await asyncio.get_running_loop().run_in_executor(_file_executor, partial(method, **kwargs))
+        return call
+
+def _atomic_write(path: str, data: bytes):
+    """Writes to a temporary file next to `path` and renames it over `path` so that readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.urandom(8).hex()}.tmp"
+    try:
+        with open(tmp, "wb") as file: file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+class UploadResult(NamedTuple):
+    path: str
+    url: str|None
+    error: Exception|None
+    attempts: int
+    latency: float # seconds from the first attempt to the last one finishing
+
+class UploadPipeline:
+    """Async iterator of `UploadResult`s created by `AsyncCDNStore.upload_pipeline`."""
+    def __init__(self, store: AsyncCDNStore, items: AsyncIterable[tuple[str, str]]|Iterable[tuple[str, str]], max_in_flight: int = MAX_IN_FLIGHT, retries: int = RETRY_COUNT, skip_unchanged: bool = False):
+        self.store = store
+        self.items = items
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.skip_unchanged = skip_unchanged
+        self.latencies: list[float] = []
+        self.num_failed = 0
+        self.num_retries = 0
+        self.elapsed = 0.0
+
+    def __aiter__(self) -> AsyncIterator[UploadResult]:
+        return self._run()
+
+    async def _run(self) -> AsyncIterator[UploadResult]:
+        s3_client = await self.store._client()
+        start = time.perf_counter()
+        pending = set()
+        try:
+            async for path, content in _aiter(self.items):
+                # backpressure: stop pulling items until a slot frees up
+                if len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done: yield self._record(task.result(), start)
+                pending.add(asyncio.create_task(self._upload(s3_client, path, content)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done: yield self._record(task.result(), start)
+        finally:
+            for task in pending: task.cancel()
+
+    async def _upload(self, s3_client, path: str, content: str) -> UploadResult:
+        start, attempts = time.perf_counter(), 0
+        try:
+            async for attempt in AsyncRetrying(stop=stop_after_attempt(self.retries), wait=wait_random_exponential(multiplier=0.5, max=10), retry=retry_if_exception(_transient), reraise=True):
+                with attempt:
+                    attempts += 1
+                    url = await self.store._upload(s3_client, path, content, self.skip_unchanged)
+            return UploadResult(path, url, None, attempts, time.perf_counter() - start)
+        except Exception as e:
+            return UploadResult(path, None, e, attempts, time.perf_counter() - start)
+
+    def _record(self, result: UploadResult, start: float) -> UploadResult:
+        self.latencies.append(result.latency)
+        self.num_failed += result.error is not None
+        self.num_retries += result.attempts - 1
+        self.elapsed = time.perf_counter() - start
+        return result
+
+    @property
+    def stats(self) -> dict:
+        """Counts, objects per second and latency percentiles (seconds) of the results yielded so far."""
+        latencies = np.array(self.latencies)
+        return {
+            "num_items": len(latencies),
+            "num_failed": self.num_failed,
+            "num_retries": self.num_retries,
+            "elapsed": self.elapsed,
+            "items_per_second": len(latencies) / self.elapsed if self.elapsed else 0.0,
+            "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+            "latency_max": float(latencies.max()) if len(latencies) else 0.0
+        }
+
+def _transient(error: BaseException) -> bool:
+    """Throttling, server side and connection errors are worth retrying, client errors are not."""
+    if isinstance(error, ClientError): return str(error.response.get("Error", {}).get("Code")) in _TRANSIENT_CODES
+    return isinstance(error, (BotoConnectionError, HTTPClientError, ConnectionError, asyncio.TimeoutError))
+
+async def _aiter(items: AsyncIterable|Iterable) -> AsyncIterator:
+    if hasattr(items, "__aiter__"):
+        async for item in items: yield item
+    else:
+        for item in items: yield item
 
 def _public_url(public_url: str, key: str) -> str:
     """Creates a public access URL based on template. Ex: https://{bucket}.t3.tigrisfiles.io/{key}"""
@@ -1,14 +1,51 @@
+import os
+import time
 from abc import ABC, abstractmethod
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Iterable, NamedTuple
+import numpy as np
 from .models import *
+from .simplevectordb import SimpleVectorDB
 
 BEANS = "beans"
 PUBLISHERS = "publishers"
 CHATTERS = "chatters"
 RELATED_BEANS = "related_beans"
+EMBEDDINGS = "bean_embeddings" # side table of the beans embeddings in the split storage layout
 FIXED_CATEGORIES = "fixed_categories"
 FIXED_SENTIMENTS = "fixed_sentiments"
 NOT_IMPLEMENTED = NotImplementedError("Method not implemented in base class")
 DATETIME = datetime|tuple[datetime, datetime]
+DUPLICATE_WINDOW = timedelta(days=int(os.getenv("DUPLICATE_WINDOW_DAYS", 2)))
+# hybrid search defaults
+SEARCH_LIMIT = 25
+SEARCH_CANDIDATES = 4 # each leg of a hybrid search fetches this many times (limit + offset) candidates
+TEXT_WEIGHT = 0.5
+RRF_K = 60
+# vector queries over quantized embeddings fetch this many times the requested rows and re-rank them by the exact float distance
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", 20))
+# type-ahead defaults
+SUGGEST_LIMIT = 10
+SUGGEST_KINDS = [K_ENTITIES, K_REGIONS, K_CATEGORIES, K_SOURCE]
+LIST_COLUMNS = [K_CATEGORIES, K_REGIONS, K_ENTITIES, K_SENTIMENTS]
+# facet defaults
+FACET_COLUMNS = LIST_COLUMNS + [K_SOURCE, K_KIND]
+FACETS = [K_CATEGORIES, K_REGIONS, K_SOURCE, K_KIND]
+FACET_LIMIT = 10
+FACET_CACHE_TTL = timedelta(seconds=int(os.getenv("FACET_CACHE_TTL", 60)))
+FACET_CACHE_SIZE = 256
+# bean queries select one of these projections (or an explicit column list) instead of whole rows
+PROJECTIONS = {
+    "card": CARD_COLUMNS,
+    "digest": CARD_COLUMNS + [K_SUMMARY],
+    "full": None,
+}
+DEFAULT_PROJECTION = os.getenv("DEFAULT_PROJECTION", "card")
+# columns left out of the lean projections, loaded on demand by `load_fields`
+HEAVY_COLUMNS = [K_SUMMARY, K_CONTENT, K_EMBEDDING]
+# distinct estimates use 2**HLL_PRECISION registers i.e. ~0.8% relative standard error
+HLL_PRECISION = 14
 
 class Beansack(ABC):
     @abstractmethod
@@ -22,6 +59,17 @@ class Beansack(ABC):
     @abstractmethod
     def store_related(self, related_beans: list[dict]):
         raise NOT_IMPLEMENTED
+
+    def store_unique_beans(self, beans: list[Bean], gate: "NearDuplicateGate"):
+        """Stores the beans that are not near-duplicates of a recently stored bean according to `gate`.
+        Near-duplicates are linked to the bean they duplicate through `store_related` instead of being stored.
+        Returns the number of stored beans and the number of related links."""
+        if not beans: return 0, 0
+
+        unique, related = gate.split(beans)
+        count = self.store_beans(unique)
+        gate.add(unique)
+        return count, self.store_related(related)
     
     @abstractmethod
     def store_chatters(self, chatters: list[Chatter]):
@@ -53,11 +101,15 @@ class Beansack(ABC):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[Bean]:
+        """Returns the latest beans matching the filters. 
+        `text` restricts the beans to full-text matches on title, summary and content (web search syntax on PG).
+        `columns` is a list of columns or a name of PROJECTIONS and defaults to DEFAULT_PROJECTION."""
         raise NOT_IMPLEMENTED
     
     @abstractmethod
@@ -70,10 +122,11 @@ class Beansack(ABC):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[TrendingBean]:
         raise NOT_IMPLEMENTED
     
@@ -88,13 +141,37 @@ class Beansack(ABC):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[AggregatedBean]:
         raise NOT_IMPLEMENTED
     
+    @abstractmethod
+    def search_beans(self,
+        text: str = None,
+        embedding: list[float] = None,
+        kind: str = None, 
+        created: DATETIME = None, 
+        collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, 
+        entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        conditions: list[str] = None,
+        text_weight: float = TEXT_WEIGHT,
+        limit: int = SEARCH_LIMIT, offset: int = 0, 
+        columns: list[str] | str = None
+    ) -> list[Bean]:
+        """Runs a full-text query on title/summary/content and a vector query under the same filters and 
+        returns the beans ordered by their weighted reciprocal-rank fusion score 
+        `text_weight/(RRF_K + text_rank) + (1 - text_weight)/(RRF_K + vector_rank)`.
+        Either `text` or `embedding` may be omitted to run only the other leg."""
+        raise NOT_IMPLEMENTED
+    
     # @abstractmethod
     # def query_aggregated_chatters(self, urls: list[str] = None, updated: DATETIME = None, limit: int = 0, offset: int = 0, columns: list[str] = None) -> list[TrendingBean]:        
     #     raise NOT_IMPLEMENTED
@@ -114,6 +191,23 @@ class Beansack(ABC):
     # def query_chatters(self, collected: DATETIME = None, sources: list[str] = None, conditions: list[str] = None, limit: int = 0, offset: int = 0, columns: list[str] = None) -> list[Chatter]:
     #     raise NOT_IMPLEMENTED
     
+    def load_fields(self, beans: list[Bean], columns: list[str] = HEAVY_COLUMNS) -> list[Bean]:
+        """Fills the `columns` that a projection left out of `beans` in place, with a single lookup by url for the whole batch.
+        Beans that already have all of `columns` are not looked up. Returns `beans`."""
+        pending = list({bean.url for bean in beans if any(getattr(bean, column) is None for column in columns)})
+        if not pending: return beans
+
+        loaded = {item.url: item for item in self._fetch_fields(pending, columns)}
+        for bean in beans:
+            if not (item := loaded.get(bean.url)): continue
+            for column in columns:
+                if getattr(bean, column) is None: setattr(bean, column, getattr(item, column))
+        return beans
+
+    @abstractmethod
+    def _fetch_fields(self, urls: list[str], columns: list[str]) -> list[Bean]:
+        raise NOT_IMPLEMENTED
+    
     @abstractmethod
     def distinct_categories(self, limit: int = 0, offset: int = 0) -> list[str]:
         raise NOT_IMPLEMENTED   
@@ -134,8 +228,67 @@ class Beansack(ABC):
     def distinct_publishers(self, limit: int = 0, offset: int = 0) -> list[str]:
         raise NOT_IMPLEMENTED
 
+    def facet_counts(self, facets: list[str] = FACETS, limit: int = FACET_LIMIT, **filters) -> dict[str, dict[str, int]]:
+        """Counts the beans matching `filters` by every facet in a single pass over the filtered beans.
+
+        Parameters:
+            facets: columns of FACET_COLUMNS to count. List columns count each of their values.
+            limit: number of values kept per facet, most frequent first. 0 keeps all.
+            filters: kind, created, collected, categories, regions, entities, tags, sources, text and conditions 
+                as in query_latest_beans.
+
+        Returns {facet: {value: count}} in descending count order. Results are cached per facets and filters 
+        for FACET_CACHE_TTL or until the next write through this instance; callers get their own copy."""
+        unknown = set(facets) - set(FACET_COLUMNS)
+        if unknown: raise ValueError(f"unsupported facets: {', '.join(sorted(unknown))}")
+
+        key = (tuple(facets), limit, tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(filters.items()) if value))
+        copy = lambda counts: {facet: dict(values) for facet, values in counts.items()}
+        cache = self._facet_cache
+        cached = cache.get(key)
+        if cached and cached[0] > time.monotonic(): return copy(cached[1])
+
+        counts = self._facet_counts(list(facets), limit, **filters)
+        cache.pop(key, None)
+        if len(cache) >= FACET_CACHE_SIZE: cache.pop(next(iter(cache)))
+        cache[key] = (time.monotonic() + FACET_CACHE_TTL.total_seconds(), counts)
+        return copy(counts)
+
     @abstractmethod
-    def count_rows(self, table: str, conditions: list[str] = None) -> int:
+    def _facet_counts(self, facets: list[str], limit: int,
+        kind: str = None, 
+        created: DATETIME = None, 
+        collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, 
+        entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        text: str = None,
+        conditions: list[str] = None
+    ) -> dict[str, dict[str, int]]:
+        raise NOT_IMPLEMENTED
+
+    @abstractmethod
+    def suggest(self, fragment: str, kind: str = None, limit: int = SUGGEST_LIMIT) -> list["Suggestion"]:
+        """Returns the dictionary terms (entities, regions, categories and sources) for a type-ahead query.
+        Terms starting with `fragment` come first, then terms containing it; ties go to the most frequent term.
+        `kind` is one of SUGGEST_KINDS and restricts the terms to that column."""
+        raise NOT_IMPLEMENTED
+
+    @abstractmethod
+    def count_rows(self, table: str, conditions: list[str] = None, approximate: bool = False) -> "int | Estimate":
+        """Returns the number of rows in `table` matching `conditions`.
+        With `approximate` an Estimate is returned instead of an int. Where the backend keeps trustworthy table 
+        statistics an unfiltered count is read from them, with a bound of their drift as the error. 
+        Filtered counts, and backends without such statistics, count exactly and have an error of 0."""
+        raise NOT_IMPLEMENTED
+
+    @abstractmethod
+    def count_distinct(self, table: str, column: str, conditions: list[str] = None, approximate: bool = False) -> "Estimate":
+        """Returns the number of distinct non-null values of `column` (of each value for LIST_COLUMNS) in `table`.
+        With `approximate` the count is a HyperLogLog estimate computed without materializing the distinct values 
+        and its relative standard error is returned along with it. Exact counts have an error of 0."""
         raise NOT_IMPLEMENTED
     
     # @abstractmethod
@@ -158,3 +311,170 @@ class Beansack(ABC):
     def close(self):
         raise NOT_IMPLEMENTED
 
+
+
+def project(columns: list[str] | str, model: type[Bean], table_columns: list[str]) -> list[str]:
+    """Resolves the `columns` argument of a bean query against the columns of the queried table or view.
+    A name of PROJECTIONS (None for DEFAULT_PROJECTION) selects its bean columns plus the fields that `model` adds 
+    on top of Bean, such as the trend stats and publisher fields of the views. Column lists are returned as they are."""
+    if columns is None: columns = DEFAULT_PROJECTION
+    if not isinstance(columns, str): return columns
+    if columns not in PROJECTIONS: raise ValueError(f"unknown projection {columns}, expected one of {list(PROJECTIONS)}")
+
+    fields = PROJECTIONS[columns]
+    return [
+        column for column in table_columns 
+        if column in model.model_fields and (fields is None or column in fields or column not in Bean.model_fields)
+    ]
+
+
+class NearDuplicateGate:
+    """Keeps the embeddings of recently stored beans in a `SimpleVectorDB` table and flags new beans that are 
+    within `eps` (squared l2, same as the clustering in the backends) of one of them or of an earlier bean in the same batch.
+    Each batch is checked with a single `search_many` call. Beans without an embedding always pass."""
+    index: SimpleVectorDB
+    table: str
+    eps: float
+    window: timedelta
+
+    def __init__(self, index: SimpleVectorDB|str, table: str = BEANS, eps: float = CLUSTER_EPS, window: timedelta = DUPLICATE_WINDOW):
+        """
+        Parameters:
+            index: SimpleVectorDB or a path to open one at.
+            table: table in `index` holding the recent embeddings keyed by url. Created when opening from a path.
+            eps: distance under which two beans are considered the same story.
+            window: how far back stored beans are considered.
+        """
+        if isinstance(index, str): index = SimpleVectorDB(index, {table: K_URL})
+        elif table not in index.id_keys: raise ValueError(f"{table} is not an id table of the index")
+        self.index = index
+        self.table = table
+        self.eps = eps
+        self.window = window
+
+    def split(self, beans: list[Bean]) -> tuple[list[Bean], list[dict]]:
+        """Returns the beans to store and the related links (url of the kept bean, related_url of the duplicate) for the rest."""
+        embedded = [i for i, bean in enumerate(beans) if bean.embedding]
+        if not embedded: return beans, []
+
+        vectors = np.asarray([beans[i].embedding for i in embedded], dtype=np.float32)
+        duplicate_of = {}
+        # a bean that is crawled again finds itself in the index, so it is matched against its nearest other bean
+        matches = self.index.search_many(self.table, vectors, distance_func="l2", distance=self.eps, limit=2, columns=[K_URL], since=self.window)
+        for query_index, url in zip(matches["query_index"].to_pylist(), matches[K_URL].to_pylist()):
+            i = embedded[query_index]
+            if url != beans[i].url: duplicate_of.setdefault(i, url)
+
+        # duplicates within the batch are linked to the first bean of the batch they are close to,
+        # using the same exclusive cutoff as the index search
+        squared = np.einsum("ij,ij->i", vectors, vectors)
+        distances = squared[:, None] + squared[None, :] - 2 * vectors @ vectors.T
+        kept = np.zeros(len(embedded), dtype=bool)
+        for row, i in enumerate(embedded):
+            if i in duplicate_of: continue
+            close = [j for j in np.flatnonzero(kept[:row] & (distances[row, :row] < self.eps)) if beans[embedded[j]].url != beans[i].url]
+            if close: duplicate_of[i] = beans[embedded[close[0]]].url
+            else: kept[row] = True
+
+        unique = [bean for i, bean in enumerate(beans) if i not in duplicate_of]
+        related = [{K_URL: url, "related_url": beans[i].url} for i, url in duplicate_of.items()]
+        return unique, related
+
+    def add(self, beans: list[Bean]) -> int:
+        """Adds the embeddings of stored beans to the recent-window index."""
+        beans = [bean for bean in beans if bean.embedding]
+        if not beans: return 0
+        return self.index.store(self.table, ids=[bean.url for bean in beans], embeddings=np.asarray([bean.embedding for bean in beans], dtype=np.float32))
+
+    def expire(self) -> int:
+        """Drops embeddings older than the window from the index."""
+        return self.index.expire(self.table, self.window)
+
+
+class Suggestion(NamedTuple):
+    """A dictionary term matching a type-ahead query."""
+    term: str
+    kind: str
+    occurrences: int
+
+_normalize_term = lambda text: " ".join(text.casefold().split())
+
+class SuggestionIndex:
+    """In-memory type-ahead index for backends without a trigram index.
+    Works as a flattened trie: the normalized term and each of its word suffixes are kept sorted, 
+    so the terms starting with a prefix, or having a word that starts with it, are one bisected range
+    which is ranked with numpy."""
+    suggestions: list[Suggestion]
+
+    def __init__(self, suggestions: Iterable[Suggestion]):
+        self.suggestions = list(suggestions)
+        keys = sorted(
+            (" ".join(words[start:]), i, start == 0)
+            for i, words in enumerate(_normalize_term(suggestion.term).split() for suggestion in self.suggestions)
+            for start in range(len(words))
+        )
+        self._keys = [key for key, _, _ in keys]
+        self._ids = np.fromiter((i for _, i, _ in keys), dtype=np.int64, count=len(keys))
+        occurrences = np.fromiter((suggestion.occurrences for suggestion in self.suggestions), dtype=np.int64, count=len(self.suggestions))
+        # terms starting with the fragment outrank the rest, then the most frequent term wins
+        self._scores = occurrences[self._ids] + np.fromiter((whole for _, _, whole in keys), dtype=bool, count=len(keys)) * (occurrences.max(initial=0) + 1)
+        self._kinds = np.array([suggestion.kind for suggestion in self.suggestions], dtype=object)
+
+    def suggest(self, fragment: str, kind: str = None, limit: int = SUGGEST_LIMIT) -> list[Suggestion]:
+        prefix = _normalize_term(fragment)
+        if not prefix: return []
+
+        start, end = bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + "\U0010ffff")
+        ids, scores = self._ids[start:end], self._scores[start:end]
+        if kind:
+            matched = self._kinds[ids] == kind
+            ids, scores = ids[matched], scores[matched]
+        # a term matched through several of its words shows up once, with its best score
+        order = np.argsort(-scores, kind="stable")
+        _, first = np.unique(ids[order], return_index=True)
+        return [self.suggestions[i] for i in ids[order[np.sort(first)[:limit]]]]
+
+
+class Estimate(NamedTuple):
+    """An approximate count and its relative error. For HyperLogLog sketches it is the standard error i.e. roughly 
+    2 in 3 estimates are within value*(1 ± error); for counts read from table statistics it bounds their drift."""
+    value: int
+    error: float
+
+class HyperLogLog:
+    """HyperLogLog sketch over 64-bit hashes. The low `precision` bits of a hash pick the register and 
+    the rank of the highest set bit in the remaining bits is kept per register. 
+    SQL backends fold in the per-register minimum of the remaining bits, which yields the same maximum rank."""
+    precision: int
+    registers: np.ndarray
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def mask(self) -> int:
+        return (1 << self.precision) - 1
+
+    @property
+    def error(self) -> float:
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add(self, hashes: np.ndarray):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.fold(hashes & np.uint64(self.mask), hashes >> np.uint64(self.precision))
+
+    def fold(self, registers: np.ndarray, rests: np.ndarray):
+        """Folds in the registers and remaining bits (at most 64 - precision of them) of hashes."""
+        # the remaining bits fit in a float64 mantissa, so frexp gives their exact bit length
+        _, bit_length = np.frexp(np.asarray(rests, dtype=np.float64))
+        ranks = (64 - self.precision - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, np.asarray(registers, dtype=np.int64), ranks)
+
+    def estimate(self) -> Estimate:
+        m = len(self.registers)
+        value = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        # linear counting is more accurate while many registers are still empty
+        if value <= 2.5 * m and zeros: value = m * np.log(m / zeros)
+        return Estimate(int(round(value)), float(self.error))
@@ -22,6 +22,16 @@ ORDER_BY_LATEST = "created DESC"
 ORDER_BY_TRENDING = "trend_score DESC"
 ORDER_BY_DISTANCE = "distance ASC"
 
+# binary codes (sign of each dimension) of the embeddings kept next to them in the quantized mode, see quantize_embeddings
+EMBEDDING_BITS = "embedding_bits"
+_BINARY_CODE = "array_to_string(list_transform(embedding, x -> if(x > 0, '1', '0')), '')::BIT"
+_HAMMING_DISTANCE = f"bit_count(xor({EMBEDDING_BITS}, ?::BIT))"
+_binary_code = lambda embedding: "".join("1" if value > 0 else "0" for value in embedding)
+
+# full-text index of the beans table, built by the fts extension in duckdb mode
+TEXT_INDEX_SCHEMA = f"fts_main_{BEANS}"
+TEXT_INDEX_COLUMNS = [K_TITLE, K_SUMMARY, K_CONTENT]
+
 _TYPES = {
     BEANS: Bean,
     PUBLISHERS: Publisher,
@@ -34,6 +44,7 @@ _PRIMARY_KEYS: dict[str, str | list[str]] = {
     BEANS: K_URL,
     PUBLISHERS: K_SOURCE,
     RELATED_BEANS: [K_URL, "related_url"],
+    EMBEDDINGS: K_URL,
 }
 
 
@@ -95,6 +106,8 @@ class DuckSack(Beansack):
     catalog_db: str | None
     storage_path: str | None
     _mode: str
+    _table_columns: dict[str, list[str]]
+    _facet_cache: dict[tuple, tuple[float, dict[str, dict[str, int]]]]
 
     def __init__(self, db_path: str = None, catalog_db: str = None, storage_path: str = None):
         """Initialize a DuckSack connection.
@@ -111,6 +124,10 @@ class DuckSack(Beansack):
         """
         if db_path and (catalog_db or storage_path):
             raise ValueError("Provide either db_path (duckdb) OR catalog_db+storage_path (ducklake), not both.")
+        self._has_text_index = None
+        self._suggestions: SuggestionIndex | None = None
+        self._table_columns = {}
+        self._facet_cache = {}
         if db_path:
             self._mode = "duckdb"
             self.db_path = os.path.expanduser(db_path)
@@ -214,7 +231,8 @@ class DuckSack(Beansack):
         if df is None or df.empty:
             return 0
         df = _stamp_missing(df, [K_CREATED, K_COLLECTED])
-        fields = ", ".join(df.columns.to_list())
+        split = self._split_embeddings and K_EMBEDDING in df.columns
+        fields = ", ".join(column for column in df.columns.to_list() if not (split and column == K_EMBEDDING))
 
         qualified = self._qualify(BEANS)
         sql_insert = f"""
@@ -225,8 +243,22 @@ class DuckSack(Beansack):
             WHERE b.url = df.url
         );
         """
+        if split:
+            qualified_embeddings = self._qualify(EMBEDDINGS)
+            sql_insert += f"""
+            INSERT INTO {qualified_embeddings} (url, embedding)
+            SELECT url, embedding FROM df
+            WHERE embedding IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM {qualified_embeddings} e
+                WHERE e.url = df.url
+            );
+            """
+        if K_EMBEDDING in df.columns:
+            sql_insert += self._quantize_sql()
         with self.db.cursor() as cur:
             cur.execute(sql_insert)
+        self._suggestions = None
+        self._facet_cache.clear()
         return len(df)
 
     def store_related(self, related_beans: list[dict]):
@@ -300,16 +332,26 @@ class DuckSack(Beansack):
         if not fields:
             return 0
 
-        updates = ", ".join([f"{f} = pack.{f}" for f in fields])
-        qualified = self._qualify(BEANS)
-        sql_update = f"""
-        MERGE INTO {qualified}
-        USING (SELECT url, {', '.join(fields)} FROM df) AS pack
-        USING (url)
-        WHEN MATCHED THEN UPDATE SET {updates};
-        """
+        sql_update = ""
+        quantize_sql = self._quantize_sql() if K_EMBEDDING in fields else ""
+        if self._split_embeddings and K_EMBEDDING in fields:
+            fields = [f for f in fields if f != K_EMBEDDING]
+            sql_update += self._merge_embeddings_sql()
+        if fields:
+            updates = ", ".join([f"{f} = pack.{f}" for f in fields])
+            qualified = self._qualify(BEANS)
+            sql_update += f"""
+            MERGE INTO {qualified}
+            USING (SELECT url, {', '.join(fields)} FROM df) AS pack
+            USING (url)
+            WHEN MATCHED THEN UPDATE SET {updates};
+            """
+        sql_update += quantize_sql
         with self.db.cursor() as cur:
             cur.execute(sql_update)
+        if set(fields) & set(SUGGEST_KINDS):
+            self._suggestions = None
+        self._facet_cache.clear()
         return len(df)
 
     def update_embeddings(self, beans: list[Bean]):
@@ -320,6 +362,7 @@ class DuckSack(Beansack):
             return 0
 
         qualified_beans = self._qualify(BEANS)
+        split = self._split_embeddings
         qualified_categories = self._qualify(FIXED_CATEGORIES)
         qualified_sentiments = self._qualify(FIXED_SENTIMENTS)
 
@@ -346,12 +389,35 @@ class DuckSack(Beansack):
         MERGE INTO {qualified_beans}
         USING (SELECT * FROM update_pack) AS pack
         USING (url)
-        WHEN MATCHED THEN UPDATE SET embedding = pack.embedding, categories = pack.categories, sentiments = pack.sentiments;
+        WHEN MATCHED THEN UPDATE SET {"" if split else "embedding = pack.embedding, "}categories = pack.categories, sentiments = pack.sentiments;
         """
+        if split:
+            sql_update += self._merge_embeddings_sql()
+        sql_update += self._quantize_sql()
         with self.db.cursor() as cur:
             cur.execute(sql_update)
+        self._facet_cache.clear()
         return len(df)
 
+    def _quantize_sql(self) -> str:
+        """Refreshes the binary codes of the embeddings written from the `df` frame in scope, if the embeddings are quantized."""
+        if not self._quantized_embeddings:
+            return ""
+        return f"""
+        UPDATE {self._qualify(self._embeddings_table)} SET {EMBEDDING_BITS} = {_BINARY_CODE}
+        WHERE embedding IS NOT NULL AND url IN (SELECT url FROM df);
+        """
+
+    def _merge_embeddings_sql(self) -> str:
+        """Upserts the non-null embeddings of the `df` frame in scope into the EMBEDDINGS side table."""
+        return f"""
+        MERGE INTO {self._qualify(EMBEDDINGS)}
+        USING (SELECT url, ANY_VALUE(embedding) AS embedding FROM df WHERE embedding IS NOT NULL GROUP BY url) AS pack
+        USING (url)
+        WHEN MATCHED THEN UPDATE SET embedding = pack.embedding
+        WHEN NOT MATCHED THEN INSERT (url, embedding) VALUES (pack.url, pack.embedding);
+        """
+
     def update_publishers(self, publishers: list[Publisher]):
         df = _publishers_to_df(publishers)
         if df is None or df.empty:
@@ -374,14 +440,63 @@ class DuckSack(Beansack):
             cur.execute(sql_update)
         return len(df)
 
-    def _select(self, table: str, columns: list[str] = None, embedding: list[float] = None):
+    def _columns_of(self, table: str) -> list[str]:
+        """Returns the column names of `table`, read once from an empty relation."""
+        if table not in self._table_columns:
+            with self.db.cursor() as cur:
+                self._table_columns[table] = cur.query(f"SELECT * FROM {self._qualify(table)} LIMIT 0").columns
+        return self._table_columns[table]
+
+    @property
+    def _split_embeddings(self) -> bool:
+        """Whether the embeddings live in the EMBEDDINGS side table instead of beans.embedding."""
+        return K_EMBEDDING not in self._columns_of(BEANS)
+
+    @property
+    def _embeddings_table(self) -> str:
+        return EMBEDDINGS if self._split_embeddings else BEANS
+
+    @property
+    def _quantized_embeddings(self) -> bool:
+        """Whether the embeddings carry binary codes that vector queries search first."""
+        return EMBEDDING_BITS in self._columns_of(self._embeddings_table)
+
+    def _first_pass(self, source: str, where_expr: str, where_params: list[Any], embedding: list[float], limit: int) -> tuple[str, list[Any]]:
+        """Returns the FROM expression and parameters of the compact first pass of a vector query over quantized embeddings:
+        the RERANK_FACTOR * `limit` rows of `source` nearest by the hamming distance of their binary codes, 
+        which the caller re-ranks by exact distance."""
+        expr = f"(SELECT * FROM {source}{where_expr} ORDER BY {_HAMMING_DISTANCE} LIMIT ?) AS candidates"
+        return expr, [*where_params, _binary_code(embedding), limit * RERANK_FACTOR]
+
+    def _embedded(self, table: str, columns: list[str], embedding: list[float] = None, conditions: list[str] = None) -> str:
+        """Returns the FROM expression of a bean relation. In the split layout EMBEDDINGS is joined
+        only when the query selects, filters or ranks by the embedding."""
+        qualified = self._qualify(table)
+        if not self._split_embeddings:
+            return qualified
+        if embedding or K_EMBEDDING in columns or any(K_EMBEDDING in condition for condition in conditions or []):
+            return f"{qualified} LEFT JOIN {self._qualify(EMBEDDINGS)} USING ({K_URL})"
+        return qualified
+
+    def _select(self, table: str, columns: list[str] | str = None, embedding: list[float] = None, conditions: list[str] = None, candidates: tuple[str, list[Any], int] = None):
+        source = self._qualify(table)
+        model = _TYPES.get(table)
+        if model and issubclass(model, Bean):
+            table_columns = self._columns_of(table) + ([K_EMBEDDING] if self._split_embeddings else [])
+            columns = project(columns, model, table_columns)
+            source = self._embedded(table, columns, embedding, conditions)
         fields = columns.copy() if columns else ["*"]
         if embedding:
             fields.append(
                 f"array_cosine_distance(embedding::FLOAT[{VECTOR_LEN}], ?::FLOAT[{VECTOR_LEN}]) AS distance"
             )
-            return f"SELECT {', '.join(fields)} FROM {self._qualify(table)}", [embedding]
-        return f"SELECT {', '.join(fields)} FROM {self._qualify(table)}", []
+            params = [embedding]
+            # candidates (the filters and the number of rows) limit the exact distances to a quantized first pass
+            if candidates and self._quantized_embeddings:
+                source, first_pass_params = self._first_pass(source, candidates[0], candidates[1], embedding, candidates[2])
+                params.extend(first_pass_params)
+            return f"SELECT {', '.join(fields)} FROM {source}", params
+        return f"SELECT {', '.join(fields)} FROM {source}", []
 
     def _where(
         self,
@@ -395,6 +510,7 @@ class DuckSack(Beansack):
         entities: list[str] = None,
         tags: list[str] = None,
         sources: list[str] = None,
+        text: str = None,
         distance: float = 0,
         conditions: list[str] = None,
     ):
@@ -453,6 +569,11 @@ class DuckSack(Beansack):
             exprs.append(f"source IN ({', '.join('?' for _ in sources)})")
             params.extend(sources)
 
+        if text:
+            score_expr, score_params = self._text_score(text)
+            exprs.append(f"{score_expr} IS NOT NULL")
+            params.extend(score_params)
+
         if distance:
             exprs.append("distance <= ?")
             params.append(distance)
@@ -477,16 +598,16 @@ class DuckSack(Beansack):
         entities: list[str] = None,
         tags: list[str] = None,
         sources: list[str] = None,
+        text: str = None,
         embedding: list[float] = None,
         distance: float = 0,
         conditions: list[str] = None,
         order: str = None,
         limit: int = 0,
         offset: int = 0,
-        columns: list[str] = None,
+        columns: list[str] | str = None,
     ):
-        select_expr, select_params = self._select(table, columns, embedding)
-        where_expr, where_params = self._where(
+        filters = dict(
             urls=urls,
             kind=kind,
             created=created,
@@ -497,9 +618,12 @@ class DuckSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
-            distance=distance,
+            text=text,
             conditions=conditions,
         )
+        candidates = (*self._where(**filters), limit + offset) if embedding and limit else None
+        select_expr, select_params = self._select(table, columns, embedding, conditions, candidates)
+        where_expr, where_params = self._where(**filters, distance=distance)
         expr = select_expr + where_expr
         params: list[Any] = []
         params.extend(select_params)
@@ -528,12 +652,13 @@ class DuckSack(Beansack):
         entities: list[str] = None,
         tags: list[str] = None,
         sources: list[str] = None,
+        text: str = None,
         embedding: list[float] = None,
         distance: float = 0,
         conditions: list[str] = None,
         limit: int = 0,
         offset: int = 0,
-        columns: list[str] = None,
+        columns: list[str] | str = None,
     ) -> list[Bean]:
         return self._fetch_all(
             table=BEANS,
@@ -546,6 +671,7 @@ class DuckSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -565,12 +691,13 @@ class DuckSack(Beansack):
         entities: list[str] = None,
         tags: list[str] = None,
         sources: list[str] = None,
+        text: str = None,
         embedding: list[float] = None,
         distance: float = 0,
         conditions: list[str] = None,
         limit: int = 0,
         offset: int = 0,
-        columns: list[str] = None,
+        columns: list[str] | str = None,
     ) -> list[TrendingBean]:
         return self._fetch_all(
             table="trending_beans_view",
@@ -583,6 +710,7 @@ class DuckSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -603,12 +731,13 @@ class DuckSack(Beansack):
         entities: list[str] = None,
         tags: list[str] = None,
         sources: list[str] = None,
+        text: str = None,
         embedding: list[float] = None,
         distance: float = 0,
         conditions: list[str] = None,
         limit: int = 0,
         offset: int = 0,
-        columns: list[str] = None,
+        columns: list[str] | str = None,
     ) -> list[AggregatedBean]:
         return self._fetch_all(
             table="aggregated_beans_view",
@@ -622,6 +751,7 @@ class DuckSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -631,6 +761,136 @@ class DuckSack(Beansack):
             columns=columns,
         )
 
+    def _text_index(self) -> bool:
+        """Whether the fts index of the beans table exists and the extension can be loaded to query it."""
+        if self._has_text_index is None:
+            try:
+                self.execute("LOAD fts;")
+                self._has_text_index = bool(self.query("SELECT 1 FROM duckdb_schemas() WHERE schema_name = ?", [TEXT_INDEX_SCHEMA]))
+            except duckdb.Error:
+                self._has_text_index = False
+        return self._has_text_index
+
+    def _refresh_text_index(self):
+        """(Re)builds the fts index of the beans table, done by optimize.
+        DuckLake tables cannot carry an fts index and always use the ILIKE fallback."""
+        if self._mode != "duckdb":
+            return
+        columns = ", ".join(f"'{column}'" for column in TEXT_INDEX_COLUMNS)
+        try:
+            self.execute(f"INSTALL fts; LOAD fts; PRAGMA create_fts_index('{BEANS}', '{K_URL}', {columns}, overwrite = 1);")
+            self._has_text_index = True
+        except duckdb.Error as e:
+            log.warning("fts index not built", extra={"source": BEANS, "error": str(e)})
+
+    def _text_score(self, text: str) -> tuple[str, list[Any]]:
+        """Full-text score expression of a beans row; NULL when the row does not match.
+        Rows in the fts index are scored by BM25. The index is a snapshot taken by optimize, so rows stored
+        after it (and every row when there is no index) are scored by the ILIKE fallback: each query term
+        found in a column scores by the column's position in TEXT_INDEX_COLUMNS i.e. title > summary > content."""
+        like_expr, like_params = self._like_score(text)
+        if not self._text_index():
+            return like_expr, like_params
+        expr = f"""COALESCE(
+            {TEXT_INDEX_SCHEMA}.match_bm25({K_URL}, ?),
+            CASE WHEN {K_URL} NOT IN (SELECT name FROM {TEXT_INDEX_SCHEMA}.docs) THEN {like_expr} END
+        )"""
+        return expr, [text, *like_params]
+
+    def _like_score(self, text: str) -> tuple[str, list[Any]]:
+        terms = list(dict.fromkeys(text.lower().split()))
+        weights = range(len(TEXT_INDEX_COLUMNS), 0, -1)
+        expr = " + ".join(
+            f"{weight} * COALESCE({column} ILIKE ?, FALSE)::INT"
+            for _ in terms
+            for column, weight in zip(TEXT_INDEX_COLUMNS, weights)
+        )
+        return f"NULLIF({expr}, 0)", [f"%{term}%" for term in terms for _ in TEXT_INDEX_COLUMNS]
+
+    def search_beans(
+        self,
+        text: str = None,
+        embedding: list[float] = None,
+        kind: str = None,
+        created: DATETIME = None,
+        collected: DATETIME = None,
+        categories: list[str] = None,
+        regions: list[str] = None,
+        entities: list[str] = None,
+        tags: list[str] = None,
+        sources: list[str] = None,
+        conditions: list[str] = None,
+        text_weight: float = TEXT_WEIGHT,
+        limit: int = SEARCH_LIMIT,
+        offset: int = 0,
+        columns: list[str] | str = None,
+    ) -> list[Bean]:
+        """Fuses the two legs in a single statement: each leg ranks its top candidates in a CTE and
+        the fused scores are joined back to beans once."""
+        if not text and not embedding:
+            raise ValueError("text or embedding is required")
+
+        qualified = self._qualify(BEANS)
+        filters = dict(kind=kind, created=created, collected=collected, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources)
+        candidates = (limit + offset) * SEARCH_CANDIDATES
+        ctes, cte_params, legs, leg_params = [], [], [], []
+        if embedding:
+            where_expr, where_params = self._where(**filters, conditions=(conditions or []) + ["embedding IS NOT NULL"])
+            source, source_params = self._embedded(BEANS, [K_EMBEDDING]) + where_expr, where_params
+            if self._quantized_embeddings:
+                source, source_params = self._first_pass(self._embedded(BEANS, [K_EMBEDDING]), where_expr, where_params, embedding, candidates)
+            ctes.append(f"""
+            vector_hits AS (
+                SELECT url, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT url, array_cosine_distance(embedding::FLOAT[{VECTOR_LEN}], ?::FLOAT[{VECTOR_LEN}]) AS distance
+                    FROM {source}
+                    ORDER BY distance
+                    LIMIT ?
+                )
+            )""")
+            cte_params.extend([embedding, *source_params, candidates])
+            legs.append("vector_hits")
+            leg_params.append(1 - text_weight)
+        if text:
+            score_expr, score_params = self._text_score(text)
+            where_expr, where_params = self._where(**filters, conditions=conditions)
+            ctes.append(f"""
+            text_hits AS (
+                SELECT url, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT url, {score_expr} AS score
+                    FROM {qualified}{where_expr}
+                )
+                WHERE score IS NOT NULL
+                ORDER BY score DESC
+                LIMIT ?
+            )""")
+            cte_params.extend([*score_params, *where_params, candidates])
+            legs.append("text_hits")
+            leg_params.append(text_weight)
+
+        split = self._split_embeddings
+        columns = project(columns, Bean, self._columns_of(BEANS) + ([K_EMBEDDING] if split else []))
+        fields_expr = ", ".join(f"e.{column}" if split and column == K_EMBEDDING else f"b.{column}" for column in columns)
+        embeddings_expr = f"LEFT JOIN {self._qualify(EMBEDDINGS)} e ON e.url = f.url" if split and K_EMBEDDING in columns else ""
+        hits_expr = " UNION ALL ".join(f"SELECT url, ? / ({RRF_K} + rank) AS score FROM {leg}" for leg in legs)
+        expr = f"""
+        WITH {", ".join(ctes)},
+        fused AS (
+            SELECT url, SUM(score) AS search_score
+            FROM ({hits_expr})
+            GROUP BY url
+        )
+        SELECT {fields_expr}
+        FROM fused f
+        INNER JOIN {qualified} b ON b.url = f.url
+        {embeddings_expr}
+        ORDER BY f.search_score DESC
+        LIMIT ? OFFSET ?
+        """
+        return [Bean(**item) for item in self.query(expr, params=[*cte_params, *leg_params, limit, offset])]
+
     def query_publishers(
         self,
         collected: DATETIME = None,
@@ -653,6 +913,9 @@ class DuckSack(Beansack):
             columns=columns,
         )
 
+    def _fetch_fields(self, urls: list[str], columns: list[str]) -> list[Bean]:
+        return self._fetch_all(table=BEANS, urls=urls, columns=[K_URL] + columns)
+
     def distinct_categories(self, limit: int = 0, offset: int = 0) -> list[str]:
         expr = f"SELECT category FROM {self._qualify(FIXED_CATEGORIES)} ORDER BY category"
         if limit:
@@ -682,11 +945,104 @@ class DuckSack(Beansack):
         expr = f"SELECT source FROM {qualified} ORDER BY source"
         return [row["source"] for row in self.query(expr)]
 
-    def count_rows(self, table: str, conditions: list[str] = None) -> int:
+    def _facet_counts(
+        self,
+        facets: list[str],
+        limit: int,
+        kind: str = None,
+        created: DATETIME = None,
+        collected: DATETIME = None,
+        categories: list[str] = None,
+        regions: list[str] = None,
+        entities: list[str] = None,
+        tags: list[str] = None,
+        sources: list[str] = None,
+        text: str = None,
+        conditions: list[str] = None,
+    ) -> dict[str, dict[str, int]]:
+        """The filtered beans are materialized once, then every facet is unnested and grouped in the same statement."""
+        where_expr, params = self._where(
+            kind=kind,
+            created=created,
+            collected=collected,
+            categories=categories,
+            regions=regions,
+            entities=entities,
+            tags=tags,
+            sources=sources,
+            text=text,
+            conditions=conditions,
+        )
+        values_expr = " UNION ALL ".join(
+            f"SELECT '{facet}' AS facet, {f'unnest({facet})' if facet in LIST_COLUMNS else facet}::VARCHAR AS value FROM filtered"
+            for facet in facets
+        )
+        expr = f"""
+        WITH filtered AS MATERIALIZED (
+            SELECT {", ".join(facets)} FROM {self._qualify(BEANS)}{where_expr}
+        ),
+        counts AS (
+            SELECT facet, value, COUNT(*) AS count, ROW_NUMBER() OVER (PARTITION BY facet ORDER BY COUNT(*) DESC, value) AS rank
+            FROM ({values_expr})
+            WHERE value IS NOT NULL
+            GROUP BY facet, value
+        )
+        SELECT facet, value, count FROM counts
+        {"WHERE rank <= ?" if limit else ""}
+        ORDER BY facet, rank
+        """
+        if limit:
+            params.append(limit)
+
+        counts = {facet: {} for facet in facets}
+        for row in self.query(expr, params=params):
+            counts[row["facet"]][row["value"]] = row["count"]
+        return counts
+
+    def suggest(self, fragment: str, kind: str = None, limit: int = SUGGEST_LIMIT) -> list[Suggestion]:
+        """Answers from an in-memory SuggestionIndex over the beans terms.
+        The index is built on first use and rebuilt after beans are stored or their terms updated through this instance."""
+        if self._suggestions is None:
+            qualified = self._qualify(BEANS)
+            terms_expr = " UNION ALL ".join(
+                f"SELECT '{column}' AS kind, {column} AS term FROM {qualified}" if column == K_SOURCE
+                else f"SELECT '{column}' AS kind, unnest({column}) AS term FROM {qualified}"
+                for column in SUGGEST_KINDS
+            )
+            expr = f"SELECT term, kind, COUNT(*) AS occurrences FROM ({terms_expr}) WHERE term IS NOT NULL GROUP BY kind, term"
+            self._suggestions = SuggestionIndex(Suggestion(**row) for row in self.query(expr))
+        return self._suggestions.suggest(fragment, kind=kind, limit=limit)
+
+    def count_rows(self, table: str, conditions: list[str] = None, approximate: bool = False) -> int | Estimate:
+        """Always counts exactly. The catalog's estimated_size also counts the row versions left by updates and deletes, 
+        even after a checkpoint, while an unfiltered count(*) is answered from row group metadata in about a millisecond."""
         where_expr, where_params = self._where(conditions=conditions)
         expr = f"SELECT count(*) AS count FROM {self._qualify(table)}{where_expr};"
         rows = self.query(expr, params=where_params)
-        return int(rows[0]["count"]) if rows else 0
+        count = int(rows[0]["count"]) if rows else 0
+        return Estimate(count, 0.0) if approximate else count
+
+    def count_distinct(self, table: str, column: str, conditions: list[str] = None, approximate: bool = False) -> Estimate:
+        """The HyperLogLog registers are computed in SQL from DuckDB's 64-bit hash, so only the per-register
+        minimums (at most 2**HLL_PRECISION rows) are fetched. approx_count_distinct is not used as its
+        precision is fixed and too coarse for the error bound."""
+        where_expr, where_params = self._where(conditions=conditions)
+        value_expr = f"unnest({column})" if column in LIST_COLUMNS else column
+        values_expr = f"SELECT {value_expr} AS value FROM {self._qualify(table)}{where_expr}"
+        if not approximate:
+            rows = self.query(f"SELECT COUNT(DISTINCT value) AS count FROM ({values_expr})", params=where_params)
+            return Estimate(int(rows[0]["count"]), 0.0)
+
+        sketch = HyperLogLog()
+        expr = f"""
+        SELECT hash(value) & {sketch.mask} AS register, MIN(hash(value) >> {sketch.precision}) AS rest
+        FROM ({values_expr})
+        WHERE value IS NOT NULL
+        GROUP BY register
+        """
+        rows = self.query(expr, params=where_params)
+        sketch.fold([row["register"] for row in rows], [row["rest"] for row in rows])
+        return sketch.estimate()
 
     def query(self, query_expr: str, params: list[Any] = None) -> list[dict]:
         with self.db.cursor() as cur:
@@ -771,6 +1127,7 @@ class DuckSack(Beansack):
         WHERE GREATEST(likes, comments, shares, related) > 0;
         """
         self.execute(sql_refresh)
+        self._refresh_text_index()
 
     def cleanup(self):
         if self._mode != "ducklake":
@@ -798,6 +1155,58 @@ class DuckSack(Beansack):
     #     with open(self.db_path, "rb") as data:
     #         store_func(data)
 
+    def migrate_embeddings(self, split: bool = True) -> int:
+        """Moves the embeddings from beans.embedding to the EMBEDDINGS side table (`split`) or back.
+        Returns the number of moved embeddings."""
+        if split == self._split_embeddings:
+            return 0
+
+        # the binary codes are recomputed on the table the embeddings move to
+        quantized = self._quantized_embeddings
+        if quantized:
+            self.quantize_embeddings(None)
+        qualified_beans = self._qualify(BEANS)
+        qualified_embeddings = self._qualify(EMBEDDINGS)
+        if split:
+            count = self.query(f"SELECT COUNT(*) AS count FROM {qualified_beans} WHERE embedding IS NOT NULL")[0]["count"]
+            self.execute(f"""
+            DELETE FROM {qualified_embeddings};
+            INSERT INTO {qualified_embeddings} (url, embedding)
+            SELECT url, embedding FROM {qualified_beans} WHERE embedding IS NOT NULL;
+            ALTER TABLE {qualified_beans} DROP COLUMN embedding;
+            """)
+        else:
+            count = self.query(f"SELECT COUNT(*) AS count FROM {qualified_embeddings}")[0]["count"]
+            self.execute(f"""
+            ALTER TABLE {qualified_beans} ADD COLUMN embedding FLOAT[];
+            UPDATE {qualified_beans} b SET embedding = e.embedding FROM {qualified_embeddings} e WHERE e.url = b.url;
+            DELETE FROM {qualified_embeddings};
+            """)
+        self._table_columns.clear()
+        if quantized:
+            self.quantize_embeddings()
+        log.info("migrated embeddings", extra={"source": EMBEDDINGS if split else BEANS, "num_items": count})
+        return count
+
+    def quantize_embeddings(self, mode: str = "bit"):
+        """Keeps a binary code of each embedding (the sign of every dimension, 32x smaller than the floats) next to it.
+        Vector queries then rank the rows by the hamming distance of the codes first and compute the exact distance
+        only for RERANK_FACTOR times the requested rows. `mode` None drops the codes."""
+        if mode and mode != "bit":
+            raise ValueError(f"unknown quantization {mode}, expected bit")
+        if bool(mode) == self._quantized_embeddings:
+            return
+
+        qualified = self._qualify(self._embeddings_table)
+        if mode:
+            self.execute(f"""
+            ALTER TABLE {qualified} ADD COLUMN {EMBEDDING_BITS} BIT;
+            UPDATE {qualified} SET {EMBEDDING_BITS} = {_BINARY_CODE} WHERE embedding IS NOT NULL;
+            """)
+        else:
+            self.execute(f"ALTER TABLE {qualified} DROP COLUMN {EMBEDDING_BITS};")
+        self._table_columns.clear()
+
     def close(self):
         if not self.db:
             return
@@ -812,6 +1221,7 @@ def create_db(*, db_path: str = None, catalog_db: str = None, storage_path: str
         os.makedirs(os.path.dirname(os.path.expanduser(db_path)) or ".", exist_ok=True)
         db = DuckSack(db_path=db_path)
         db.execute(init_sql)
+        db._refresh_text_index()
         return db
 
     if catalog_db and storage_path:
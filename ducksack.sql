@@ -24,6 +24,12 @@ CREATE TABLE IF NOT EXISTS beans (
     entities VARCHAR[]
 );
 
+-- embeddings of the beans in the split storage layout (see DuckSack.migrate_embeddings)
+CREATE TABLE IF NOT EXISTS bean_embeddings (
+    url VARCHAR NOT NULL,
+    embedding FLOAT[] NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS publishers (
     source VARCHAR NOT NULL,
     base_url VARCHAR NOT NULL,
@@ -1,11 +1,19 @@
 from cmath import log
 import os
+import threading
+import time
+from collections import defaultdict
+from functools import cached_property
 from pydantic import Field
 import lancedb
 from lancedb.rerankers import Reranker
 from lancedb.pydantic import LanceModel, Vector
+from lancedb.index import FTS
+from lancedb.query import MultiMatchQuery
 from datetime import timedelta
+from typing import Iterable, NamedTuple
 import pyarrow as pa
+import pyarrow.compute as pc
 import pandas as pd
 from .models import *
 from .database import *
@@ -14,12 +22,28 @@ import logging
 log = logging.getLogger(__name__)
 
 VECTOR_TYPE = Vector(VECTOR_LEN, nullable=True)
+SCAN_BATCH_SIZE = 8192
+DEDUP_BATCH_SIZE = 1024
+# best full-text matches considered where a `text` filter cannot run as the FTS query itself 
+# i.e. text filters of vector queries, unlimited text queries and facet counts
+TEXT_MATCH_LIMIT = 10000
+
+# background maintenance defaults
+MAINTENANCE_INTERVAL = timedelta(seconds=int(os.getenv("LANCE_MAINTENANCE_INTERVAL", 300)))
+MAINTENANCE_BUDGET = timedelta(seconds=int(os.getenv("LANCE_MAINTENANCE_BUDGET", 60)))
+MAX_FRAGMENTS = 32
+MAX_DELETED_RATIO = 0.1
+MAX_UNINDEXED_ROWS = 10000
+CLEANUP_OLDER_THAN = timedelta(days=1)
 
 _PRIMARY_KEYS = {
     BEANS: K_URL,
     PUBLISHERS: K_SOURCE
 }
 
+# columns with a full-text index, queried together by text queries
+_TEXT_COLUMNS = [K_TITLE, K_SUMMARY, K_CONTENT]
+
 class _Bean(Bean, LanceModel):
     embedding: VECTOR_TYPE = Field()
 
@@ -71,6 +95,50 @@ class _ScalarReranker(Reranker):
 
 ORDER_BY_LATEST = _ScalarReranker(column="created", desc=True)
 
+class _RRFReranker(Reranker):
+    """Weighted reciprocal-rank fusion of the vector and full-text results of a hybrid query."""
+    text_weight: float
+    k: int
+
+    def __init__(self, text_weight: float = TEXT_WEIGHT, k: int = RRF_K):
+        super().__init__("relevance")
+        self.text_weight = text_weight
+        self.k = k
+
+    def rerank_hybrid(self, query: str, vector_results: pa.Table, fts_results: pa.Table):
+        scores = defaultdict(float)
+        for results, weight in ((vector_results, 1 - self.text_weight), (fts_results, self.text_weight)):
+            for rank, rowid in enumerate(results["_rowid"].to_pylist(), 1):
+                scores[rowid] += weight / (self.k + rank)
+        table = self.merge_results(vector_results, fts_results)
+        table = table.append_column("_relevance_score", pa.array([scores[rowid] for rowid in table["_rowid"].to_pylist()], type=pa.float32()))
+        return self._keep_relevance_score(table.sort_by([("_relevance_score", "descending")]))
+
+class TableChanges(NamedTuple):
+    """Rows inserted and updated in a table after a checkpoint version."""
+    version: int
+    inserted: pa.RecordBatchReader
+    updated: pa.RecordBatchReader
+
+class _DistinctSet:
+    """Distinct values of a column as of a specific table version."""
+    version: int
+    values: set[str]
+
+    def __init__(self, version: int, values: set[str]):
+        self.version = version
+        self.values = values
+
+    @cached_property
+    def sorted_values(self) -> list[str]:
+        return sorted(self.values)
+
+# columns whose distinct values are served by distinct_* functions
+_DISTINCT_COLUMNS = {
+    BEANS: [K_CATEGORIES, K_SENTIMENTS, K_ENTITIES, K_REGIONS],
+    PUBLISHERS: [K_SOURCE]
+}
+
 class LanceSack(Beansack): 
     db: lancedb.DBConnection
     # tables: dict[str, lancedb.Table]
@@ -80,7 +148,13 @@ class LanceSack(Beansack):
     # allclusters: lancedb.Table
 
     def __init__(self, storage_path: str):
+        self.storage_path = storage_path
         self.db = _connect(storage_path)
+        self._distinct_cache: dict[tuple[str, str], _DistinctSet] = {}
+        self._suggestions: tuple[int, SuggestionIndex] = None
+        self._facet_cache = {}
+        self._maintenance: threading.Thread = None
+        self._maintenance_stop = threading.Event()
         self.db.create_table(BEANS, schema=_Bean, exist_ok=True)
         self.db.create_table(PUBLISHERS, schema=_Publisher, exist_ok=True)
         self.db.create_table(CHATTERS, schema=_Chatter, exist_ok=True)
@@ -92,9 +166,13 @@ class LanceSack(Beansack):
         if not beans: return 0
 
         # to_store = prepare_beans_for_store(beans) 
-        result = self.db[BEANS].merge_insert("url") \
+        tbl = self.db[BEANS]
+        version = tbl.version
+        result = tbl.merge_insert("url") \
             .when_not_matched_insert_all() \
             .execute([_Bean(**bean.model_dump(exclude_none=True)) for bean in beans])
+        self._fold_distinct(BEANS, version, tbl.version, beans if result.num_inserted_rows == len(beans) else None)
+        self._facet_cache.clear()
         return result.num_inserted_rows
     
     def store_related(self, related_beans: list[dict[str, str]]):
@@ -107,9 +185,12 @@ class LanceSack(Beansack):
         if not publishers: return 0
 
         # to_store = prepare_publishers_for_store(publishers)  
-        result = self.db[PUBLISHERS].merge_insert(K_SOURCE) \
+        tbl = self.db[PUBLISHERS]
+        version = tbl.version
+        result = tbl.merge_insert(K_SOURCE) \
             .when_not_matched_insert_all() \
             .execute([_Publisher(**publisher.model_dump(exclude_none=True)) for publisher in publishers])
+        self._fold_distinct(PUBLISHERS, version, tbl.version, publishers if result.num_inserted_rows == len(publishers) else None)
         return result.num_inserted_rows
     
     def store_chatters(self, chatters: list[Chatter]):
@@ -138,6 +219,7 @@ class LanceSack(Beansack):
                     schema=pa.schema(list(map(self.db[BEANS].schema.field, fields)))
                 )
             )
+        self._facet_cache.clear()
         return result.num_updated_rows
     
     # this assuming that the embedding field is already set
@@ -172,7 +254,7 @@ class LanceSack(Beansack):
             _RelatedBean(url=url, related=related) for url, related
                 in zip(urls, clusters.groupby('query_index')['url'].apply(list).sort_index().tolist())
         ])   
-
+        self._facet_cache.clear()
         return result.num_updated_rows
 
     def update_publishers(self, publishers: list[Publisher]):
@@ -194,16 +276,45 @@ class LanceSack(Beansack):
 
     # QUERY functions
     def deduplicate(self, table: str, items: list) -> list:
-        if not items: return items    
-        idkey = _PRIMARY_KEYS[table]    
-        ids = [getattr(item, idkey) for item in items]
-        existing_ids = self.tables[table].search().where(f"{idkey} IN ({list_expr(ids)})").select([idkey]).to_list()
-        existing_ids = [item[idkey] for item in existing_ids]
-        return list(filter(lambda item: getattr(item, idkey) not in existing_ids, items))
-
-    def count_rows(self, table, conditions: list[str] = None) -> int:
+        """Returns the items whose primary key does not exist in `table`.
+        Candidate ids are looked up in chunks of `DEDUP_BATCH_SIZE` through the scalar index on the primary key
+        and matched back against the items in a single vectorized pass."""
+        if not items: return items
+        idkey = _PRIMARY_KEYS[table]
+        ids = pa.array([getattr(item, idkey) for item in items], type=pa.string())
+        candidates = pc.unique(ids.drop_null())
+
+        tbl = self.db[table]
+        existing = [
+            batch.column(idkey)
+            for start in range(0, len(candidates), DEDUP_BATCH_SIZE)
+            for batch in tbl.search()
+                .where(f"{idkey} IN ({list_expr(candidates.slice(start, DEDUP_BATCH_SIZE).to_pylist())})")
+                .select([idkey])
+                .to_batches(SCAN_BATCH_SIZE)
+        ]
+        if not existing: return items
+        found = pc.is_in(ids, value_set=pa.concat_arrays(existing)).to_pylist()
+        return [item for item, exists in zip(items, found) if not exists]
+
+    def count_rows(self, table, conditions: list[str] = None, approximate: bool = False) -> int | Estimate:
+        # unfiltered counts are already answered exactly from fragment metadata, so approximate only changes the type
         where_exprs = _where(conditions=conditions)
-        return self.tables[table].count_rows(where_exprs)
+        count = self.db[table].count_rows(where_exprs)
+        return Estimate(count, 0.0) if approximate else count
+
+    def count_distinct(self, table: str, column: str, conditions: list[str] = None, approximate: bool = False) -> Estimate:
+        """Streams the column through a projection-only batched scan. 
+        The approximate count hashes each batch into a HyperLogLog sketch instead of collecting the distinct values."""
+        query = self.db[table].search().where(_where(conditions=(conditions or []) + [f"{column} IS NOT NULL"])).select([column])
+        sketch, values = HyperLogLog(), set()
+        for batch in query.to_batches(SCAN_BATCH_SIZE):
+            array = batch.column(column)
+            if pa.types.is_list(array.type): array = pc.list_flatten(array)
+            array = pc.unique(array.drop_null())
+            if approximate: sketch.add(pd.util.hash_array(array.to_numpy(zero_copy_only=False)))
+            else: values.update(array.to_pylist())
+        return sketch.estimate() if approximate else Estimate(len(values), 0.0)
 
     def _query_beans(self,
         kind: str = None, 
@@ -212,23 +323,48 @@ class LanceSack(Beansack):
         regions: list[str] = None, entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         order = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[Bean]:
-        query = self.db[BEANS].search() if not embedding else self.db[BEANS].search(query=embedding, query_type="vector", vector_column_name=K_EMBEDDING)      
+        """A `text` filter without an embedding runs as the FTS query itself, with the other filters as a prefilter.
+        With an embedding, the vector query is filtered to the best TEXT_MATCH_LIMIT full-text matches."""
+        tbl = self.db[BEANS]
         where_expr = _where(urls=None, kind=kind, created=created, collected=collected, updated=updated, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources, conditions=conditions)
-        if where_expr: query = query.where(where_expr)
-        if embedding: query = query.distance_type("cosine")
+        if embedding:
+            query = tbl.search(query=embedding, query_type="vector", vector_column_name=K_EMBEDDING)
+            if text:
+                urls = self._match_text(text, where_expr)
+                if not urls: return []
+                where_expr = _where(urls=urls, conditions=[where_expr])
+        elif text: query = tbl.search(MultiMatchQuery(text, _TEXT_COLUMNS), query_type="fts")
+        else: query = tbl.search()
+        if where_expr: query = query.where(where_expr, prefilter=True)
+        # the IVF_RQ index ranks by RaBitQ codes, refine re-ranks RERANK_FACTOR times the rows by the float vectors
+        if embedding: query = query.distance_type("cosine").refine_factor(RERANK_FACTOR)
         if distance: query = query.distance_range(upper_bound = distance)
         if order and embedding: query = query.rerank(order, query_string="default")
-        if limit: query = query.limit(limit)
+        elif order and text: query = query.rerank(order)
+        # FTS queries are always limited
+        if limit or text: query = query.limit(limit or TEXT_MATCH_LIMIT)
         if offset: query = query.offset(offset)
-        if columns: query = query.select(columns+(["_distance"] if embedding else []))
-        return query.to_pydantic(_Bean)
+        query = query.select(project(columns, Bean, tbl.schema.names)+(["_distance"] if embedding else []))
+        beans = query.to_pydantic(Bean)
+        if text and not limit: _warn_capped(len(beans) + offset)
+        return beans
     
+    def _match_text(self, text: str, where_expr: str = None) -> list[str]:
+        """Returns the urls of the best TEXT_MATCH_LIMIT full-text matches of `text` among the rows passing the other filters.
+        Lance filters cannot reference the FTS index, so `text` filters of vector queries are applied as a url filter."""
+        query = self.db[BEANS].search(MultiMatchQuery(text, _TEXT_COLUMNS), query_type="fts")
+        if where_expr: query = query.where(where_expr, prefilter=True)
+        urls = query.select([K_URL]).limit(TEXT_MATCH_LIMIT).to_arrow()[K_URL].to_pylist()
+        _warn_capped(len(urls))
+        return urls
+
     def query_latest_beans(self,
         kind: str = None, 
         created: DATETIME = None, 
@@ -237,10 +373,11 @@ class LanceSack(Beansack):
         regions: list[str] = None, entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[Bean]:
         return self._query_beans(
             kind=kind,
@@ -251,6 +388,7 @@ class LanceSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -268,10 +406,11 @@ class LanceSack(Beansack):
         regions: list[str] = None, entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[TrendingBean]:
         raise NOT_SUPPORTED
     
@@ -284,10 +423,11 @@ class LanceSack(Beansack):
         regions: list[str] = None, entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0,
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[AggregatedBean]:
         beans = self._query_beans(
             kind=kind,
@@ -299,6 +439,7 @@ class LanceSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -317,6 +458,43 @@ class LanceSack(Beansack):
         # Additional aggregation logic can be added here
         return beans
 
+    def search_beans(self,
+        text: str = None,
+        embedding: list[float] = None,
+        kind: str = None, 
+        created: DATETIME = None, 
+        collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        conditions: list[str] = None,
+        text_weight: float = TEXT_WEIGHT,
+        limit: int = SEARCH_LIMIT, offset: int = 0, 
+        columns: list[str] | str = None
+    ) -> list[Bean]:
+        """Runs both legs as a single hybrid query over the FTS and vector indexes and fuses them with `_RRFReranker`."""
+        if not text and not embedding: raise ValueError("text or embedding is required")
+
+        tbl = self.db[BEANS]
+        if text and embedding: 
+            query = tbl.search(query_type="hybrid", vector_column_name=K_EMBEDDING) \
+                .vector(embedding) \
+                .text(MultiMatchQuery(text, _TEXT_COLUMNS)) \
+                .rerank(_RRFReranker(text_weight)) \
+                .limit((limit + offset) * SEARCH_CANDIDATES)
+        elif text: query = tbl.search(MultiMatchQuery(text, _TEXT_COLUMNS), query_type="fts").limit(limit + offset)
+        else: query = tbl.search(query=embedding, query_type="vector", vector_column_name=K_EMBEDDING).limit(limit + offset)
+        if embedding: query = query.distance_type("cosine").refine_factor(RERANK_FACTOR)
+        where_expr = _where(kind=kind, created=created, collected=collected, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources, conditions=conditions)
+        if where_expr: query = query.where(where_expr)
+        query = query.select(project(columns, Bean, tbl.schema.names))
+        # Bean rather than _Bean so that projections without the embedding validate
+        return query.to_pydantic(Bean)[offset:offset+limit]
+
+    def _fetch_fields(self, urls: list[str], columns: list[str]) -> list[Bean]:
+        return self.db[BEANS].search().where(_where(urls=urls)).select([K_URL] + columns).limit(len(urls)).to_pydantic(Bean)
+
     def query_aggregated_chatters(self, urls: list[str] = None, updated: DATETIME = None, limit: int = 0, offset: int = 0, columns: list[str] = None) -> list[AggregatedBean]:      
         raise NOT_IMPLEMENTED
     
@@ -336,21 +514,125 @@ class LanceSack(Beansack):
         if columns: query = query.select(columns)
         return query.to_pydantic(_Publisher)
     
+    def _distinct(self, table: str, column: str, limit: int = 0, offset: int = 0) -> list[str]:
+        """Returns the sorted distinct values of a scalar or list `column`.
+        Values are collected through a projection-only batched scan and cached against the table version,
+        so repeated calls only rescan when the table was changed outside of this instance."""
+        tbl = self.db[table]
+        distinct = self._distinct_cache.get((table, column))
+        if not distinct or distinct.version != tbl.version:
+            version = tbl.version
+            values = set()
+            for batch in tbl.search().where(f"{column} IS NOT NULL").select([column]).to_batches(SCAN_BATCH_SIZE):
+                values.update(_unique_values(batch.column(column)))
+            distinct = self._distinct_cache[(table, column)] = _DistinctSet(version, values)
+        values = distinct.sorted_values
+        return values[offset:offset+limit] if limit else values[offset:]
+
+    def _fold_distinct(self, table: str, prev_version: int, version: int, items: list[BaseModel] = None):
+        """Folds the values of newly inserted `items` into the cached distinct sets of `table`.
+        If the write was not the only change since the cached version (or `items` is None) the cached set is dropped instead."""
+        for column in _DISTINCT_COLUMNS.get(table, []):
+            distinct = self._distinct_cache.get((table, column))
+            if not distinct: continue
+            if items is None or distinct.version != prev_version or version != prev_version + 1:
+                self._distinct_cache.pop((table, column), None)
+                continue
+            values = set(distinct.values)
+            for item in items:
+                value = getattr(item, column, None)
+                if isinstance(value, list): values.update(v for v in value if v is not None)
+                elif value is not None: values.add(value)
+            self._distinct_cache[(table, column)] = _DistinctSet(version, values)
+
     def distinct_categories(self, limit: int = 0, offset: int = 0) -> list[str]:
-        raise NOT_IMPLEMENTED
+        return self._distinct(BEANS, K_CATEGORIES, limit=limit, offset=offset)
     
     def distinct_sentiments(self, limit: int = 0, offset: int = 0) -> list[str]:
-        raise NOT_IMPLEMENTED
+        return self._distinct(BEANS, K_SENTIMENTS, limit=limit, offset=offset)
     
     def distinct_entities(self, limit: int = 0, offset: int = 0) -> list[str]:
-        raise NOT_IMPLEMENTED
+        return self._distinct(BEANS, K_ENTITIES, limit=limit, offset=offset)
     
     def distinct_regions(self, limit: int = 0, offset: int = 0) -> list[str]:
-        raise NOT_IMPLEMENTED
+        return self._distinct(BEANS, K_REGIONS, limit=limit, offset=offset)
     
     def distinct_publishers(self, limit: int = 0, offset: int = 0) -> list[str]:
-        raise NOT_IMPLEMENTED
+        return self._distinct(PUBLISHERS, K_SOURCE, limit=limit, offset=offset)
     
+    def _facet_counts(self, facets: list[str], limit: int,
+        kind: str = None, 
+        created: DATETIME = None, 
+        collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        text: str = None,
+        conditions: list[str] = None
+    ) -> dict[str, dict[str, int]]:
+        """Counts every facet in a single projection-only batched scan of the filtered beans.
+        With `text` the facets of the best TEXT_MATCH_LIMIT full-text matches are counted, read by the FTS query itself."""
+        where_expr = _where(kind=kind, created=created, collected=collected, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources, conditions=conditions)
+        query = self.db[BEANS].search(MultiMatchQuery(text, _TEXT_COLUMNS), query_type="fts") if text else self.db[BEANS].search()
+        if where_expr: query = query.where(where_expr, prefilter=True)
+        query = query.select(facets)
+        if text:
+            matches = query.limit(TEXT_MATCH_LIMIT).to_arrow()
+            _warn_capped(matches.num_rows)
+            batches = matches.to_batches()
+        else: batches = query.to_batches(SCAN_BATCH_SIZE)
+        counts = _count_values(batches, facets)
+        return {
+            facet: dict(sorted(values.items(), key=lambda item: (-item[1], item[0]))[:limit or None]) 
+            for facet, values in counts.items()
+        }
+
+    def suggest(self, fragment: str, kind: str = None, limit: int = SUGGEST_LIMIT) -> list[Suggestion]:
+        """Answers from an in-memory SuggestionIndex over the beans terms.
+        Term counts are collected through a projection-only batched scan and cached against the table version."""
+        tbl = self.db[BEANS]
+        if not self._suggestions or self._suggestions[0] != tbl.version:
+            version = tbl.version
+            counts = _count_values(tbl.search().select(SUGGEST_KINDS).to_batches(SCAN_BATCH_SIZE), SUGGEST_KINDS)
+            self._suggestions = (version, SuggestionIndex(
+                Suggestion(term, kind, occurrences) for kind, terms in counts.items() for term, occurrences in terms.items()
+            ))
+        return self._suggestions[1].suggest(fragment, kind=kind, limit=limit)
+
+    # CHANGE FEED functions
+    def changes_since(self, table: str, version: int, columns: list[str] = None) -> TableChanges:
+        """Returns the rows inserted and updated in `table` after `version` as streaming Arrow batches
+        along with the current table version, which should be used as the checkpoint for the next call.
+
+        Parameters:
+            table: name of the table.
+            version: the last version the caller has consumed. Use `table_version` to get the initial checkpoint.
+            columns: optional projection applied to the returned batches. Each batch also carries
+                `_rowid`, `_row_created_at_version` and `_row_last_updated_at_version`.
+
+        Requires the table to have stable row ids, which `create_db` enables for new tables.
+        Versions removed by `cleanup_old_versions` can no longer be diffed against.
+        """
+        ds = self.db[table].to_lance()
+        if not ds.has_stable_row_ids:
+            raise ValueError(f"{table} does not have stable row ids. Recreate it with create_db to track changes.")
+        if version > ds.version:
+            raise ValueError(f"version {version} is ahead of the current version {ds.version} of {table}")
+        if version == ds.version:
+            empty = _project_batches(pa.RecordBatchReader.from_batches(ds.schema, []), columns)
+            return TableChanges(ds.version, empty, empty)
+
+        delta = ds.delta(compared_against=version)
+        return TableChanges(
+            ds.version,
+            _project_batches(delta.get_inserted_rows(), columns),
+            _project_batches(delta.get_updated_rows(), columns)
+        )
+
+    def table_version(self, table: str) -> int:
+        return self.db[table].version
+
     # MAINTENANCE functions
     # def refresh_classifications(self):
     #     raise NOT_SUPPORTED
@@ -364,9 +646,54 @@ class LanceSack(Beansack):
     def optimize(self):
         try: self.db[BEANS].create_index(vector_column_name=K_EMBEDDING, index_type="IVF_RQ", metric="cosine")
         except: pass
+        _create_text_indexes(self.db[BEANS])
         [self.db[table].optimize() for table in self.db.table_names()]
 
+    def table_health(self, table: str) -> dict:
+        return _table_health(self.db[table])
+
+    def maintain(self, 
+        time_budget: timedelta = MAINTENANCE_BUDGET,
+        max_fragments: int = MAX_FRAGMENTS,
+        max_deleted_ratio: float = MAX_DELETED_RATIO,
+        max_unindexed_rows: int = MAX_UNINDEXED_ROWS,
+        cleanup_older_than: timedelta = CLEANUP_OLDER_THAN
+    ) -> dict[str, list[str]]:
+        """Runs one round of maintenance and returns the tasks that ran for each table. See `start_maintenance`."""
+        return _maintain(self.db, time_budget=time_budget, max_fragments=max_fragments, max_deleted_ratio=max_deleted_ratio, max_unindexed_rows=max_unindexed_rows, cleanup_older_than=cleanup_older_than)
+
+    def start_maintenance(self, interval: timedelta = MAINTENANCE_INTERVAL, **policy):
+        """Starts a background thread that runs `maintain` every `interval`.
+
+        Each round checks the fragment count, deleted-row ratio and unindexed rows of every table and,
+        worst table first, runs compaction, index optimization and old version cleanup where the thresholds are crossed.
+        Tasks are not started once the `time_budget` of the round is spent. The thread uses its own connection
+        and Lance commits optimistically, so writers are never blocked; a task that conflicts with a write is retried next round.
+
+        Parameters:
+            interval: time between the end of one round and the start of the next.
+            policy: keyword arguments of `maintain` i.e. time_budget, max_fragments, max_deleted_ratio, max_unindexed_rows, cleanup_older_than.
+        """
+        if self._maintenance and self._maintenance.is_alive(): return
+        
+        def run():
+            db = _connect(self.storage_path)
+            while not self._maintenance_stop.wait(interval.total_seconds()):
+                try: _maintain(db, **policy)
+                except Exception as e: log.warning("maintenance failed", extra={"source": self.storage_path, "error": str(e)})
+
+        self._maintenance_stop.clear()
+        self._maintenance = threading.Thread(target=run, name="lancemaintenance", daemon=True)
+        self._maintenance.start()
+
+    def stop_maintenance(self):
+        if not self._maintenance: return
+        self._maintenance_stop.set()
+        self._maintenance.join()
+        self._maintenance = None
+
     def close(self):
+        self.stop_maintenance()
         del self.db
 
 
@@ -386,13 +713,21 @@ def create_db(storage_path: str):
     publishers.create_scalar_index(K_SOURCE, index_type="BTREE")
     chatters.create_scalar_index(K_URL, index_type="BTREE")
     related_beans.create_scalar_index(K_URL, index_type="BTREE")
+    _create_text_indexes(beans)
 
     return LanceSack(storage_path)
 
+def _create_text_indexes(tbl: lancedb.table.Table):
+    """Creates the missing FTS indexes of `_TEXT_COLUMNS`. Rows added later are searched unindexed until the next index optimization."""
+    indexed = {column for index in tbl.list_indices() if index.index_type == "FTS" for column in index.columns}
+    for column in _TEXT_COLUMNS:
+        if column not in indexed: tbl.create_index(column, config=FTS())
+
 def _connect(storage_path: str):
-    storage_options = None
+    # stable row ids let changes_since diff inserted/updated rows across versions
+    storage_options = {"new_table_enable_stable_row_ids": "true"}
     if storage_path.startswith("s3://"):
-        storage_options = {
+        storage_options |= {
             "access_key_id": os.getenv("S3_ACCESS_KEY_ID"),
             "secret_access_key": os.getenv("S3_SECRET_ACCESS_KEY"),
             "endpoint": os.getenv("S3_ENDPOINT"),
@@ -405,9 +740,87 @@ def _connect(storage_path: str):
         storage_options=storage_options
     )
 
-list_expr = lambda items: ", ".join(f"'{item}'" for item in items)
+def _table_health(tbl: lancedb.table.Table) -> dict:
+    """Collects fragment, deletion and index coverage stats from table metadata."""
+    ds = tbl.to_lance()
+    fragments = ds.get_fragments()
+    physical_rows = sum(fragment.physical_rows for fragment in fragments)
+    num_rows = ds.count_rows()
+    return {
+        "num_fragments": len(fragments),
+        "num_rows": num_rows,
+        "deleted_ratio": (physical_rows - num_rows) / physical_rows if physical_rows else 0,
+        "num_unindexed_rows": max((tbl.index_stats(index.name).num_unindexed_rows for index in tbl.list_indices()), default=0)
+    }
+
+def _maintain(
+    db: lancedb.DBConnection,
+    time_budget: timedelta = MAINTENANCE_BUDGET,
+    max_fragments: int = MAX_FRAGMENTS,
+    max_deleted_ratio: float = MAX_DELETED_RATIO,
+    max_unindexed_rows: int = MAX_UNINDEXED_ROWS,
+    cleanup_older_than: timedelta = CLEANUP_OLDER_THAN
+) -> dict[str, list[str]]:
+    deadline = time.monotonic() + time_budget.total_seconds()
+    tables = {name: db[name] for name in db.table_names()}
+    health = {name: _table_health(tbl) for name, tbl in tables.items()}
+    completed = {}
+    for name in sorted(health, key=lambda name: health[name]["num_fragments"], reverse=True):
+        tbl, stats, tasks = tables[name], health[name], []
+        if stats["num_fragments"] > max_fragments or stats["deleted_ratio"] > max_deleted_ratio:
+            tasks.append("compact")
+        if stats["num_unindexed_rows"] > max_unindexed_rows:
+            tasks.append("optimize_indices")
+        if tasks:
+            tasks.append("cleanup")
+
+        for task in tasks:
+            if time.monotonic() >= deadline: 
+                log.info("maintenance budget spent", extra={"source": name, "num_items": len(completed)})
+                return completed
+            try:
+                if task == "compact": tbl.compact_files()
+                elif task == "optimize_indices": tbl.to_lance().optimize.optimize_indices()
+                elif task == "cleanup": tbl.cleanup_old_versions(older_than=cleanup_older_than)
+                completed.setdefault(name, []).append(task)
+            except Exception as e:
+                # most likely a commit conflict with a concurrent writer
+                log.warning("maintenance task failed", extra={"source": name, "task": task, "error": str(e)})
+        if name in completed: log.info("maintained", extra={"source": name, "tasks": completed[name], **stats})
+    return completed
+
+_CHANGE_COLUMNS = ["_rowid", "_row_created_at_version", "_row_last_updated_at_version"]
+
+def _project_batches(reader: pa.RecordBatchReader, columns: list[str] = None) -> pa.RecordBatchReader:
+    if not columns: return reader
+    fields = columns + [col for col in _CHANGE_COLUMNS if col in reader.schema.names and col not in columns]
+    schema = pa.schema([reader.schema.field(col) for col in fields])
+    return pa.RecordBatchReader.from_batches(schema, (batch.select(fields) for batch in reader))
+
+def _count_values(batches: Iterable[pa.RecordBatch], columns: list[str]) -> dict[str, dict]:
+    """Counts the non-null values of each column across `batches`. List columns count each of their values."""
+    counts = {column: {} for column in columns}
+    for batch in batches:
+        for column in columns:
+            values = batch.column(column)
+            if pa.types.is_list(values.type): values = pc.list_flatten(values)
+            for item in pc.value_counts(values.drop_null()).to_pylist():
+                counts[column][item["values"]] = counts[column].get(item["values"], 0) + item["counts"]
+    return counts
+
+def _unique_values(array: pa.ChunkedArray | pa.Array) -> list:
+    """Flattens list arrays and returns the unique non-null values."""
+    if pa.types.is_list(array.type) or pa.types.is_large_list(array.type) or pa.types.is_fixed_size_list(array.type):
+        array = pc.list_flatten(array)
+    return pc.unique(array.drop_null()).to_pylist()
+
+str_expr = lambda item: "'" + str(item).replace("'", "''") + "'"
+list_expr = lambda items: ", ".join(map(str_expr, items))
 date_expr = lambda date_val: f"date '{date_val.strftime('%Y-%m-%d')}'"
 
+def _warn_capped(num_matches: int):
+    if num_matches >= TEXT_MATCH_LIMIT: log.warning("text matches capped", extra={"source": BEANS, "num_items": TEXT_MATCH_LIMIT})
+
 def _where(
     urls: list[str] = None,
     kind: str = None,
@@ -423,7 +836,7 @@ def _where(
 ):
     exprs = []
     if urls: exprs.append(f"url IN ({list_expr(urls)})")
-    if kind: exprs.append(f"kind = '{kind}'")
+    if kind: exprs.append(f"kind = {str_expr(kind)}")
     if created: exprs.append(f"created >= {date_expr(created)}")
     if collected: exprs.append(f"collected >= {date_expr(collected)}")
     if updated: raise NOT_SUPPORTED
@@ -62,6 +62,7 @@ SYSTEM = "__SYSTEM__"
 
 DIGEST_COLUMNS = [K_URL, K_CREATED, K_GIST]
 CONTENT_COLUMNS = [K_URL, K_CREATED, K_SOURCE, K_TITLE, K_CONTENT]
+CARD_COLUMNS = [K_URL, K_KIND, K_SOURCE, K_TITLE, K_IMAGEURL, K_AUTHOR, K_CREATED, K_COLLECTED, K_CATEGORIES, K_REGIONS, K_ENTITIES, K_SENTIMENTS]
 
 class Chatter(BaseModel):
     """Social media engagement stats of an article/bean (specified by `url`)."""
@@ -1,5 +1,6 @@
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import cached_property
 import os
 import logging
 from pathlib import Path
@@ -33,11 +34,19 @@ _PRIMARY_KEYS = {
     BEANS: K_URL,
     PUBLISHERS: K_SOURCE,
     RELATED_BEANS: [K_URL, "related_url"],
+    EMBEDDINGS: K_URL,
 }
 
 ORDER_BY_LATEST = "created DESC"
 ORDER_BY_TRENDING = "trend_score DESC"
 ORDER_BY_DISTANCE = "distance ASC"
+TEXT_SEARCH_CONFIG = "english"
+# operator class of the quantized HNSW index and the matching first-pass distance of each quantization mode
+_QUANTIZATIONS = {
+    "halfvec": (f"(embedding::halfvec({VECTOR_LEN})) halfvec_cosine_ops", f"embedding::halfvec({VECTOR_LEN}) <=> %(embedding)s::halfvec({VECTOR_LEN})"),
+    "bit": (f"(binary_quantize(embedding)::bit({VECTOR_LEN})) bit_hamming_ops", f"binary_quantize(embedding)::bit({VECTOR_LEN}) <~> binary_quantize(%(embedding)s::vector)"),
+}
+MAX_EF_SEARCH = 1000 # upper bound of hnsw.ef_search
 
 log = logging.getLogger(__name__)
 
@@ -66,6 +75,8 @@ def _insert_multivalues_sql(table: str, columns: list[str], rowcount: int):
 
 class PGSack(Beansack):
     pool: ConnectionPool
+    _table_columns: dict[str, list[str]]
+    _facet_cache: dict[tuple, tuple[float, dict[str, dict[str, int]]]]
 
     def __init__(self, conn_str: str):
         """Initialize the Beansack with a PostgreSQL connection string."""
@@ -80,6 +91,8 @@ class PGSack(Beansack):
             configure=register_vector
         )
         self.pool.open()
+        self._table_columns = {}
+        self._facet_cache = {}
 
     @contextmanager
     def cursor(self):
@@ -147,7 +160,12 @@ class PGSack(Beansack):
 
     def store_beans(self, beans: list[Bean]):
         """Store a list of Beans in the database."""
-        return self._store(BEANS, beans)
+        if not self._split_embeddings: count = self._store(BEANS, beans)
+        else:
+            count = self._store(BEANS, [bean.model_dump(exclude={K_EMBEDDING}) for bean in beans])
+            self._store(EMBEDDINGS, [{K_URL: bean.url, K_EMBEDDING: bean.embedding} for bean in beans if bean.embedding])
+        self._facet_cache.clear()
+        return count
     
     def store_related(self, related_beans: list[dict]):
         return self._store(RELATED_BEANS, related_beans)
@@ -208,7 +226,25 @@ class PGSack(Beansack):
     def update_beans(self, beans: list[Bean], columns: list[str] = None):
         """Partially update a list of Beans in the database."""
         if not beans: return 0
-        return self._update(BEANS, beans, columns)
+        if not self._split_embeddings: count = self._update(BEANS, beans, columns)
+        else:
+            columns = columns or list(Bean.model_fields.keys())
+            count = 0
+            if K_EMBEDDING in columns: count = self._upsert_embeddings(beans)
+            columns = [column for column in columns if column not in (K_URL, K_EMBEDDING)]
+            if columns: count = self._update(BEANS, beans, columns)
+        self._facet_cache.clear()
+        return count
+
+    def _upsert_embeddings(self, beans: list[Bean]) -> int:
+        data = [(bean.url, Vector(bean.embedding)) for bean in beans if bean.embedding]
+        if not data: return 0
+        SQL_UPSERT = sql.SQL("INSERT INTO {table} (url, embedding) VALUES (%s, %s) ON CONFLICT (url) DO UPDATE SET embedding = EXCLUDED.embedding;").format(
+            table=sql.Identifier(EMBEDDINGS)
+        )
+        with self.cursor() as cur:
+            cur.executemany(SQL_UPSERT, data)
+        return len(data)
     
     # def update_embeddings(self, beans: list[Bean]):
     #     """Update embeddings for a list of Beans and the computed categories + sentiments during the process."""
@@ -253,8 +289,11 @@ class PGSack(Beansack):
         return self._update(PUBLISHERS, publishers, columns=None)    
 
     @retry(stop=stop_after_attempt(RETRY_COUNT), wait=wait_fixed(RETRY_DELAY), reraise=True)
-    def _query_composites(self, expr: str, params: dict = None) -> list[Any]:
+    def _query_composites(self, expr: str, params: dict = None, settings: dict = None) -> list[Any]:
         with self.pool.connection() as conn:
+            # settings are local to the transaction of the query
+            for name, value in (settings or {}).items():
+                conn.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
             with conn.execute(expr, params=params, binary=True) as cur:
                 rows = cur.fetchall()
                 cols = [desc[0] for desc in cur.description]
@@ -276,6 +315,50 @@ class PGSack(Beansack):
                 result = cur.fetchone()         
         return result[0]
 
+    def _columns_of(self, table: str) -> list[str]:
+        """Returns the column names of `table`, read once from an empty result."""
+        if table not in self._table_columns:
+            with self.pool.connection() as conn:
+                with conn.execute(f"SELECT * FROM {table} LIMIT 0") as cur:
+                    self._table_columns[table] = [desc[0] for desc in cur.description]
+        return self._table_columns[table]
+
+    @property
+    def _split_embeddings(self) -> bool:
+        """Whether the embeddings live in the EMBEDDINGS side table instead of beans.embedding."""
+        return K_EMBEDDING not in self._columns_of(BEANS)
+
+    @cached_property
+    def _quantization(self) -> str | None:
+        """The mode of the quantized HNSW index that vector queries search first, None when the float indexes are used."""
+        table = EMBEDDINGS if self._split_embeddings else BEANS
+        indexes = self._query_scalars("SELECT indexname FROM pg_indexes WHERE tablename = %(table)s", {"table": table})
+        return next((mode for mode in _QUANTIZATIONS if f"idx_{table}_embedding_hnsw_{mode}" in indexes), None)
+
+    def _first_pass(self, source: str, where_expr: str, limit: int) -> tuple[str, dict, dict]:
+        """Returns the FROM expression, parameters and settings of the compact first pass of a vector query: 
+        the RERANK_FACTOR * `limit` rows of `source` nearest in the quantized index, which the caller re-ranks by exact distance.
+        Without a quantized index `source` and `where_expr` are returned as they are."""
+        if not self._quantization or not limit: return f"{source} {where_expr}", {}, {}
+        candidates = limit * RERANK_FACTOR
+        expr = f"""(
+                SELECT * FROM {source} {where_expr}
+                ORDER BY {_QUANTIZATIONS[self._quantization][1]}
+                LIMIT %(rerank_candidates)s
+            ) candidates"""
+        settings = {"hnsw.ef_search": min(candidates, MAX_EF_SEARCH), "hnsw.iterative_scan": "relaxed_order"}
+        return expr, {"rerank_candidates": candidates}, settings
+
+    def _embedded(self, table: str, columns: list[str], embedding: list[float] = None, conditions: list[str] = None) -> str:
+        """Returns the FROM expression of a bean relation. In the split layout EMBEDDINGS is joined 
+        only when the query selects, filters or ranks by the embedding. Ranking by the embedding 
+        takes an inner join so that the planner can drive the query from the HNSW index of EMBEDDINGS."""
+        if not self._split_embeddings: return table
+        if embedding: return f"{table} JOIN {EMBEDDINGS} USING ({K_URL})"
+        if K_EMBEDDING in columns or any(K_EMBEDDING in condition for condition in conditions or []):
+            return f"{table} LEFT JOIN {EMBEDDINGS} USING ({K_URL})"
+        return table
+
     def _fetch_all(self, 
         table: str,
         urls: list[str] = None,
@@ -286,12 +369,20 @@ class PGSack(Beansack):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         order: str = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ):        
+        source = table
+        model = _TYPES.get(table)
+        if model and issubclass(model, Bean): 
+            table_columns = self._columns_of(table) + ([K_EMBEDDING] if self._split_embeddings else [])
+            columns = project(columns, model, table_columns)
+            source = self._embedded(table, columns, embedding, conditions)
+        if columns and embedding and "distance" not in columns: columns = columns + ["distance"]
         fields_expr = ", ".join(columns) if columns else "*"
         # Build base WHERE conditions (without embedding distance)
         where_expr, where_params = _where( 
@@ -305,17 +396,20 @@ class PGSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             conditions=conditions
         )
         params = where_params
+        settings = None
         
         # Use CTE when embedding is provided
         if embedding:
+            source_expr, first_pass_params, settings = self._first_pass(source, where_expr, limit + offset)
+            params.update(first_pass_params)
             expr = f"""
             WITH vector_distances AS (
                 SELECT *, (embedding <=> %(embedding)s::vector) AS distance
-                FROM {table}
-                {where_expr}
+                FROM {source_expr}
             )
             SELECT {fields_expr}
             FROM vector_distances
@@ -325,7 +419,7 @@ class PGSack(Beansack):
             params['distance'] = distance
         else:
             # No embedding, use regular query
-            expr = f"SELECT {fields_expr} FROM {table} {where_expr} "
+            expr = f"SELECT {fields_expr} FROM {source} {where_expr} "
         
         # Add ORDER BY
         if embedding: order = f"{ORDER_BY_DISTANCE}, {order}" if order else ORDER_BY_DISTANCE
@@ -337,7 +431,7 @@ class PGSack(Beansack):
             expr += limit_expr
             params.update(limit_params)
         
-        items = self._query_composites(expr, params)
+        items = self._query_composites(expr, params, settings)
         if table in _TYPES: items = [_TYPES[table](**item) for item in items]
         log.debug("queried", extra={"source": table, "num_items": len(items)})
         return items
@@ -350,10 +444,11 @@ class PGSack(Beansack):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[Bean]:
         return self._fetch_all(
             table=BEANS, 
@@ -366,6 +461,7 @@ class PGSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -383,10 +479,11 @@ class PGSack(Beansack):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[TrendingBean]:
         return self._fetch_all(
             table="trending_beans_view", 
@@ -399,6 +496,7 @@ class PGSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -417,10 +515,11 @@ class PGSack(Beansack):
         entities: list[str] = None, 
         tags: list[str] = None,
         sources: list[str] = None, 
+        text: str = None,
         embedding: list[float] = None, distance: float = 0, 
         conditions: list[str] = None,
         limit: int = 0, offset: int = 0, 
-        columns: list[str] = None
+        columns: list[str] | str = None
     ) -> list[AggregatedBean]:
         return self._fetch_all(
             table="aggregated_beans_view",
@@ -433,6 +532,7 @@ class PGSack(Beansack):
             entities=entities,
             tags=tags,
             sources=sources,
+            text=text,
             embedding=embedding,
             distance=distance,
             conditions=conditions,
@@ -442,6 +542,86 @@ class PGSack(Beansack):
             columns=columns
         )
 
+    def search_beans(self,
+        text: str = None,
+        embedding: list[float] = None,
+        kind: str = None, 
+        created: DATETIME = None, collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, 
+        entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        conditions: list[str] = None,
+        text_weight: float = TEXT_WEIGHT,
+        limit: int = SEARCH_LIMIT, offset: int = 0, 
+        columns: list[str] | str = None
+    ) -> list[Bean]:
+        """Fuses the two legs in a single statement: the top candidates of the HNSW cosine index and 
+        of the GIN indexed `search_text` are ranked in their own CTEs and joined back to beans once."""
+        if not text and not embedding: raise ValueError("text or embedding is required")
+
+        filters = dict(kind=kind, created=created, collected=collected, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources)
+        params = {"candidates": (limit + offset) * SEARCH_CANDIDATES}
+        settings = None
+        legs = []
+        if embedding:
+            where_expr, where_params = _where(**filters, conditions=(conditions or []) + ["embedding IS NOT NULL"])
+            source_expr, first_pass_params, settings = self._first_pass(self._embedded(BEANS, [K_EMBEDDING], embedding), where_expr, params["candidates"])
+            params.update(where_params)
+            params.update(first_pass_params)
+            params.update({"embedding": embedding, "vector_weight": 1 - text_weight})
+            legs.append(("vector_hits", "vector_weight", f"""
+            vector_hits AS (
+                SELECT url, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT url, embedding <=> %(embedding)s::vector AS distance
+                    FROM {source_expr}
+                    ORDER BY distance
+                    LIMIT %(candidates)s
+                ) v
+            )"""))
+        if text:
+            where_expr, where_params = _where(**filters, text=text, conditions=conditions)
+            params.update(where_params)
+            params["text_weight"] = text_weight
+            legs.append(("text_hits", "text_weight", f"""
+            text_hits AS (
+                SELECT url, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT url, ts_rank_cd(search_text, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(text)s)) AS score
+                    FROM beans
+                    {where_expr}
+                    ORDER BY score DESC
+                    LIMIT %(candidates)s
+                ) t
+            )"""))
+
+        split = self._split_embeddings
+        columns = project(columns, Bean, self._columns_of(BEANS) + ([K_EMBEDDING] if split else []))
+        fields_expr = ", ".join(f"e.{column}" if split and column == K_EMBEDDING else f"b.{column}" for column in columns)
+        embeddings_expr = f"LEFT JOIN {EMBEDDINGS} e ON e.url = f.url" if split and K_EMBEDDING in columns else ""
+        hits_expr = " UNION ALL ".join(f"SELECT url, %({weight})s::float / ({RRF_K} + rank) AS score FROM {name}" for name, weight, _ in legs)
+        limit_expr, limit_params = _limit(limit=limit, offset=offset)
+        params.update(limit_params)
+        expr = f"""
+        WITH {", ".join(cte for _, _, cte in legs)},
+        fused AS (
+            SELECT url, SUM(score) AS search_score
+            FROM ({hits_expr}) hits
+            GROUP BY url
+        )
+        SELECT {fields_expr}
+        FROM fused f
+        INNER JOIN beans b ON b.url = f.url
+        {embeddings_expr}
+        ORDER BY f.search_score DESC
+        {limit_expr}"""
+
+        items = [Bean(**item) for item in self._query_composites(expr, params, settings)]
+        log.debug("searched", extra={"source": BEANS, "num_items": len(items)})
+        return items
+
     def query_aggregated_chatters(self, urls: list[str] = None, updated: DATETIME = None, limit: int = 0, offset: int = 0, columns: list[str] = None) -> list[AggregatedBean]:        
         return self._fetch_all(
             table="_materialized_chatter_aggregates",
@@ -484,6 +664,9 @@ class PGSack(Beansack):
             columns=columns
         )
     
+    def _fetch_fields(self, urls: list[str], columns: list[str]) -> list[Bean]:
+        return self._fetch_all(table=BEANS, urls=urls, columns=[K_URL] + columns)
+
     def distinct_categories(self, limit: int = 0, offset: int = 0) -> list[str]:
         expr = "SELECT category FROM fixed_categories ORDER BY category "
         limit_expr, limit_params = _limit(limit=limit, offset=offset)
@@ -514,11 +697,93 @@ class PGSack(Beansack):
         expr += limit_expr
         return self._query_scalars(expr, limit_params)
 
-    def count_rows(self, table: str, conditions: list[str] = None) -> int:
+    def _facet_counts(self, facets: list[str], limit: int,
+        kind: str = None, 
+        created: DATETIME = None, collected: DATETIME = None,
+        categories: list[str] = None, 
+        regions: list[str] = None, 
+        entities: list[str] = None, 
+        tags: list[str] = None,
+        sources: list[str] = None, 
+        text: str = None,
+        conditions: list[str] = None
+    ) -> dict[str, dict[str, int]]:
+        """The filtered beans are materialized once, then every facet is unnested and grouped in the same statement."""
+        where_expr, params = _where(kind=kind, created=created, collected=collected, categories=categories, regions=regions, entities=entities, tags=tags, sources=sources, text=text, conditions=conditions)
+        values_expr = " UNION ALL ".join(
+            f"SELECT '{facet}' AS facet, {f'unnest({facet})' if facet in LIST_COLUMNS else facet}::varchar AS value FROM filtered"
+            for facet in facets
+        )
+        expr = f"""
+        WITH filtered AS MATERIALIZED (
+            SELECT {", ".join(facets)} FROM beans {where_expr}
+        ),
+        counts AS (
+            SELECT facet, value, COUNT(*) AS count, ROW_NUMBER() OVER (PARTITION BY facet ORDER BY COUNT(*) DESC, value) AS rank
+            FROM ({values_expr}) facet_values
+            WHERE value IS NOT NULL
+            GROUP BY facet, value
+        )
+        SELECT facet, value, count FROM counts
+        {"WHERE rank <= %(limit)s" if limit else ""}
+        ORDER BY facet, rank"""
+        params["limit"] = limit
+
+        counts = {facet: {} for facet in facets}
+        for item in self._query_composites(expr, params):
+            counts[item["facet"]][item["value"]] = item["count"]
+        return counts
+
+    def suggest(self, fragment: str, kind: str = None, limit: int = SUGGEST_LIMIT) -> list[Suggestion]:
+        """Matches the dictionary through its trigram index: substring matches and, for typos, 
+        terms with a word similar to `fragment`."""
+        fragment = " ".join(fragment.split())
+        if not fragment: return []
+
+        escaped = fragment.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params = {"fragment": fragment, "prefix": escaped + "%", "contains": "%" + escaped + "%", "kind": kind, "limit": limit}
+        expr = f"""
+        SELECT term, kind, occurrences FROM dictionary
+        WHERE (term ILIKE %(contains)s OR %(fragment)s <%% term) {"AND kind = %(kind)s" if kind else ""}
+        ORDER BY term ILIKE %(prefix)s DESC, word_similarity(%(fragment)s, term) DESC, occurrences DESC
+        LIMIT %(limit)s"""
+        return [Suggestion(**item) for item in self._query_composites(expr, params)]
+
+    def count_rows(self, table: str, conditions: list[str] = None, approximate: bool = False) -> int | Estimate:
+        if approximate and not conditions:
+            # reltuples is kept by autovacuum/ANALYZE and is -1 for a table that was never analyzed.
+            # every row inserted, updated or deleted since is in n_mod_since_analyze, which bounds the drift;
+            # statistics that drifted by more than their own count are not worth returning
+            stats = self._query_composites("""
+            SELECT c.reltuples::bigint AS value, COALESCE(s.n_mod_since_analyze, 0) AS modified 
+            FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid 
+            WHERE c.oid = %(table)s::regclass""", {"table": table})
+            if stats and 0 <= stats[0]["modified"] < stats[0]["value"]: 
+                return Estimate(stats[0]["value"], stats[0]["modified"] / stats[0]["value"])
         expr = f"SELECT count(*) FROM {table} "
         where_exprs, _ = _where(conditions=conditions)
         if where_exprs: expr += where_exprs        
-        return self._query_one(expr)
+        count = self._query_one(expr)
+        return Estimate(count, 0.0) if approximate else count
+
+    def count_distinct(self, table: str, column: str, conditions: list[str] = None, approximate: bool = False) -> Estimate:
+        """The HyperLogLog registers are computed in SQL from hashtextextended, so only the per-register 
+        minimums (at most 2**HLL_PRECISION rows) leave the database."""
+        where_expr, _ = _where(conditions=conditions)
+        values_expr = f"SELECT {f'unnest({column})' if column in LIST_COLUMNS else column} AS value FROM {table} {where_expr}"
+        if not approximate:
+            return Estimate(self._query_one(f"SELECT COUNT(DISTINCT value) FROM ({values_expr}) v"), 0.0)
+
+        sketch = HyperLogLog()
+        expr = f"""
+        SELECT hash & {sketch.mask} AS register, MIN((hash >> {sketch.precision}) & {(1 << (64 - sketch.precision)) - 1}) AS rest
+        FROM (
+            SELECT hashtextextended(value::text, 0) AS hash FROM ({values_expr}) v WHERE value IS NOT NULL
+        ) hashes
+        GROUP BY register"""
+        items = self._query_composites(expr)
+        sketch.fold([item["register"] for item in items], [item["rest"] for item in items])
+        return sketch.estimate()
     
     # MAINTENANCE METHODS
     def execute(self, sql: str, params = None):
@@ -600,7 +865,14 @@ class PGSack(Beansack):
         DELETE FROM chatters 
         WHERE collected < CURRENT_DATE - INTERVAL '{BEANSACK_CLEANUP_WINDOW}';
         """)        
+        self.execute(f"""
+        DELETE FROM {EMBEDDINGS} e
+        WHERE NOT EXISTS (
+            SELECT 1 FROM beans WHERE url = e.url
+        );
+        """)
         self.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY trend_aggregates;")
+        self.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY dictionary;")
         # NOTE: ideally this should be before the refresh but the current deletion is a hit or miss
         self.execute("""
         DELETE FROM related_beans rb 
@@ -608,18 +880,70 @@ class PGSack(Beansack):
             SELECT 1 FROM beans WHERE url = rb.url
         );
         """)
+        self._facet_cache.clear()
     
+    def migrate_embeddings(self, split: bool = True) -> int:
+        """Moves the embeddings from beans.embedding to the EMBEDDINGS side table (`split`) or back.
+        The views are recreated since they select b.*. Returns the number of moved embeddings."""
+        if split == self._split_embeddings: return 0
+
+        # the quantized index is rebuilt on the table the embeddings move to
+        quantization = self._quantization
+        if quantization: self.quantize_embeddings(None)
+        with self.cursor() as cur:
+            if split:
+                cur.execute(f"""
+                INSERT INTO {EMBEDDINGS} (url, embedding) 
+                SELECT url, embedding FROM beans WHERE embedding IS NOT NULL
+                ON CONFLICT (url) DO UPDATE SET embedding = EXCLUDED.embedding;""")
+                count = cur.rowcount
+                cur.execute("ALTER TABLE beans DROP COLUMN embedding CASCADE;")
+            else:
+                cur.execute(f"ALTER TABLE beans ADD COLUMN embedding vector({VECTOR_LEN});")
+                cur.execute(f"UPDATE beans b SET embedding = e.embedding FROM {EMBEDDINGS} e WHERE e.url = b.url;")
+                count = cur.rowcount
+                cur.execute(f"TRUNCATE {EMBEDDINGS};")
+            cur.execute(_init_sql())
+        self._table_columns.clear()
+        self.__dict__.pop("_quantization", None)
+        if quantization: self.quantize_embeddings(quantization)
+        log.info("migrated embeddings", extra={"source": EMBEDDINGS if split else BEANS, "num_items": count})
+        return count
+
+    def quantize_embeddings(self, mode: str = "bit"):
+        """Replaces the float HNSW indexes of the embeddings with a single HNSW index over their `mode` quantization: 
+        "halfvec" (half precision, 2x smaller) or "bit" (binary quantization, 32x smaller). Vector queries then search 
+        the quantized index first and re-rank RERANK_FACTOR times the requested rows by the exact float distance.
+        `mode` None restores the float indexes. The float vectors themselves are kept either way."""
+        if mode and mode not in _QUANTIZATIONS: raise ValueError(f"unknown quantization {mode}, expected one of {list(_QUANTIZATIONS)}")
+        if mode == self._quantization: return
+
+        table = EMBEDDINGS if self._split_embeddings else BEANS
+        drops = [f"idx_{table}_embedding_hnsw_{other}" for other in _QUANTIZATIONS if other != mode]
+        if mode: drops += [f"idx_{table}_embedding_hnsw_cosine", f"idx_{table}_embedding_hnsw_l2"]
+        with self.cursor() as cur:
+            for index in drops: cur.execute(f"DROP INDEX IF EXISTS {index};")
+            if mode:
+                cur.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{table}_embedding_hnsw_{mode} ON {table} USING hnsw ({_QUANTIZATIONS[mode][0]})
+                    WITH (m = 16, ef_construction = 64);""")
+            # pgsack.sql only creates the float indexes when there is no quantized one
+            else: cur.execute(_init_sql())
+        self.__dict__.pop("_quantization", None)
+
     def close(self):        
         self.pool.close()
         
 def create_db(conn_str: str) -> PGSack:
     """Create the new tables, views, indexes etc."""
     db = PGSack(conn_str)  # Just to ensure the DB is reachable
-    with open(os.path.join(os.path.dirname(__file__), 'pgsack.sql'), 'r') as sql_file:
-        init_sql = sql_file.read()         
-    db.execute(init_sql)
+    db.execute(_init_sql())
     return db
 
+def _init_sql() -> str:
+    with open(os.path.join(os.path.dirname(__file__), 'pgsack.sql'), 'r') as sql_file:
+        return sql_file.read()
+
 def _store_parquet(db, file_path: Path, table_name: str, override: bool = False):
     """Load a parquet file into a database table, converting embedding columns to lists."""
     df = pd.read_parquet(file_path)    
@@ -634,6 +958,7 @@ def _where(
     created: DATETIME = None, collected: DATETIME = None, updated: DATETIME = None,
     categories: list[str] = None, regions: list[str] = None, entities: list[str] = None, tags: list[str] = None,
     sources: list[str] = None, 
+    text: str = None,
     conditions: list[str] = None,
 ):    
     exprs = []
@@ -684,6 +1009,9 @@ def _where(
     if sources: 
         exprs.append("source = ANY(%(sources)s)")
         params['sources'] = sources
+    if text:
+        exprs.append(f"search_text @@ websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(text)s)")
+        params['text'] = text
     # Note: embedding distance filtering is handled in _fetch_all() via CTE
     if conditions: exprs.extend(conditions)
     if exprs: return ("WHERE " + " AND ".join(exprs), {k: v for k, v in params.items() if v})
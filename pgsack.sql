@@ -51,12 +51,42 @@ CREATE TABLE IF NOT EXISTS beans (
     regions VARCHAR[],
     entities VARCHAR[],
 
-    -- TEXT SEARCH FIELD
+    -- TEXT SEARCH FIELDS
     tags TSVECTOR GENERATED ALWAYS AS (
         to_tsvector('simple', immutable_tags_to_text(regions, entities, categories))
+    ) STORED,
+    -- content is capped to stay clear of the 1MB tsvector limit
+    search_text TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('english', COALESCE(summary, '')), 'B') ||
+        setweight(to_tsvector('english', LEFT(COALESCE(content, ''), 100000)), 'C')
     ) STORED
 );
 
+-- beans tables created before search_text existed or before it covered content
+-- CASCADE drops the views and the search_text index, which are recreated below
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'beans' AND column_name = 'search_text' AND generation_expression LIKE '%content%'
+    ) THEN
+        ALTER TABLE beans DROP COLUMN IF EXISTS search_text CASCADE;
+        ALTER TABLE beans ADD COLUMN search_text TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+            setweight(to_tsvector('english', COALESCE(summary, '')), 'B') ||
+            setweight(to_tsvector('english', LEFT(COALESCE(content, ''), 100000)), 'C')
+        ) STORED;
+    END IF;
+END $$;
+
+-- embeddings of the beans in the split storage layout (see PGSack.migrate_embeddings)
+-- keeping the vectors out of the beans rows makes the heap scans of beans and of the views narrower
+CREATE TABLE IF NOT EXISTS bean_embeddings (
+    url VARCHAR NOT NULL PRIMARY KEY,
+    embedding vector(384) NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS publishers (
     source VARCHAR NOT NULL PRIMARY KEY,
     base_url VARCHAR NOT NULL,
@@ -151,14 +181,32 @@ SELECT
 FROM trend_stats
 WHERE GREATEST(likes, comments, shares, related) > 0;
 
-CREATE OR REPLACE VIEW trending_beans_view AS
+-- type-ahead dictionary of the terms used in beans, refreshed by optimize() like trend_aggregates
+CREATE MATERIALIZED VIEW IF NOT EXISTS dictionary AS
+SELECT kind, term, COUNT(*) AS occurrences
+FROM (
+    SELECT 'entities' AS kind, unnest(entities) AS term FROM beans
+    UNION ALL
+    SELECT 'regions', unnest(regions) FROM beans
+    UNION ALL
+    SELECT 'categories', unnest(categories) FROM beans
+    UNION ALL
+    SELECT 'source', source FROM beans
+) terms
+WHERE term IS NOT NULL
+GROUP BY kind, term;
+
+-- dropped and recreated so that b.* picks up new beans columns
+DROP VIEW IF EXISTS trending_beans_view;
+CREATE VIEW trending_beans_view AS
 SELECT
     b.*,
     tr.updated, tr.comments, tr.shares, tr.likes, tr.subscribers, tr.related, tr.trend_score
 FROM beans b
 INNER JOIN trend_aggregates tr ON b.url = tr.url;
 
-CREATE OR REPLACE VIEW aggregated_beans_view AS
+DROP VIEW IF EXISTS aggregated_beans_view;
+CREATE VIEW aggregated_beans_view AS
 WITH related_groups AS (
     SELECT url, ARRAY_AGG(related_url) AS related_urls
     FROM related_beans
@@ -185,11 +233,33 @@ CREATE INDEX IF NOT EXISTS idx_beans_regions ON beans USING gin(regions);
 
 -- tags search
 CREATE INDEX IF NOT EXISTS idx_beans_tags ON beans USING gin(tags);
+-- full-text search
+CREATE INDEX IF NOT EXISTS idx_beans_search_text ON beans USING gin(search_text);
 -- vector search
-CREATE INDEX IF NOT EXISTS idx_beans_embedding_hnsw_cosine ON beans USING hnsw (embedding vector_cosine_ops)
-    WITH (m = 16, ef_construction = 64);
-CREATE INDEX IF NOT EXISTS idx_beans_embedding_hnsw_l2 ON beans USING hnsw (embedding vector_l2_ops)
-    WITH (m = 16, ef_construction = 64);
+-- float indexes of the table holding the embeddings: beans, or bean_embeddings in the split storage layout
+-- they are skipped once PGSack.quantize_embeddings replaced them with a quantized index
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['beans', 'bean_embeddings'] LOOP
+        CONTINUE WHEN NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = tbl AND column_name = 'embedding'
+        );
+        CONTINUE WHEN EXISTS (
+            SELECT 1 FROM pg_indexes
+            WHERE tablename = tbl AND indexname IN ('idx_' || tbl || '_embedding_hnsw_halfvec', 'idx_' || tbl || '_embedding_hnsw_bit')
+        );
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)', 'idx_' || tbl || '_embedding_hnsw_cosine', tbl);
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING hnsw (embedding vector_l2_ops) WITH (m = 16, ef_construction = 64)', 'idx_' || tbl || '_embedding_hnsw_l2', tbl);
+    END LOOP;
+END $$;
+
+-- dictionary
+-- the unique index is required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dictionary_kind_term ON dictionary(kind, term);
+CREATE INDEX IF NOT EXISTS idx_dictionary_term_trgm ON dictionary USING gin(term gin_trgm_ops);
 
 -- publishers
 CREATE INDEX IF NOT EXISTS idx_publishers_source ON publishers(source);
@@ -1,23 +1,39 @@
 
-from datetime import datetime, timezone
+import glob
+import os
+from datetime import datetime, timedelta, timezone
 
 import lancedb
 from lancedb.pydantic import LanceModel, Vector
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 from typing import Any, Literal, Optional
-from .utils import VECTOR_LEN
+from .utils import VECTOR_LEN, content_hash
 
 ITEMS = "__items__"
 ID = "id"
 TS = "ts"
+EMBEDDING = "embedding"
+DISTANCE = "_distance"
+QUERY_INDEX = "query_index"
 INDEXING_THRESHOLD = 100000
+HNSW_THRESHOLD = 1000000 # tables up to this size get an IVF_HNSW_SQ index, larger ones a quantized IVF index
+PARTITION_SIZE = 4096 # target rows per IVF partition for quantized indexes
+REINDEX_GROWTH = 2 # rebuild the index from scratch once the table grows this many times past the indexed rows
+VECTOR_INDEX = "embedding_idx"
+DEFAULT_LIMIT = 10 # same as lancedb vector search
+FLAT_DIR = "_flat"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1000000))
+LOOKUP_BATCH_SIZE = 1024
+MAX_DISTANCE_MATRIX = 1 << 24 # number of float32 distances computed at once by search_many (64MB)
 DISTANCE_FUNC = Literal["l2", "cosine", "dot"]
 
 class SimpleVectorDB:
     db: lancedb.DBConnection
     id_keys: dict[str, str]
 
-    def __init__(self, db_path: str, table_id_keys: dict[str, str], **additional_tables):
+    def __init__(self, db_path: str, table_id_keys: dict[str, str], distance_func: DISTANCE_FUNC = "l2", **additional_tables):
         """Opens connection to existing or new simple database on `db_path`.
         Creates tables specified in `table_id_keys` if they don't exist. Each table will have an id and embedding columns.          
         Additional static tables can be created (if they don't exist) by passing them as keyword arguments.
@@ -25,10 +41,15 @@ class SimpleVectorDB:
         Parameters:
             db_path: path to the database
             table_id_keys: dict where the key is the table name and the value is the id key for the table. The id key is used for upsert operations.
+            distance_func: distance function the vector indexes are built for. Searches with the same function use the index.
             additional_tables: Names and data for additional static tables. Data should be dict[str, pd.DataFrame|list[dict[str, list[float]]]]. Once created, subsequent calls do not need to pass the same static tables.
         """
         self.db = lancedb.connect(db_path)
         self.id_keys = table_id_keys.copy()
+        self.distance_func = distance_func
+        # brute-force engine for tables below INDEXING_THRESHOLD, persisted next to the tables for local databases
+        self.flat_dir = os.path.join(db_path, FLAT_DIR) if "://" not in db_path else None
+        self._flat_tables: dict[str, _FlatTable] = {}
 
         for table_name, id_key in self.id_keys.items():
             tab = self.db.create_table(
@@ -42,12 +63,14 @@ class SimpleVectorDB:
             )
             try: tab.create_scalar_index(id_key, replace=False)
             except: pass
+            try: tab.create_scalar_index(TS, replace=False)
+            except: pass
         # setup additonal tables
         for table_name, table_data in additional_tables.items():
             self.db.create_table(table_name, data=table_data, exist_ok=True)
         
     @classmethod
-    def create_db(cls, db_path: str, table_id_keys: dict[str, str], **additional_tables):
+    def create_db(cls, db_path: str, table_id_keys: dict[str, str], distance_func: DISTANCE_FUNC = "l2", **additional_tables):
         """Classifications should be dict[str, pd.DataFrame|list[dict[str, list[float]]]] where the dataframe has columns "category" or "sentiment" and "embedding" """
         db = lancedb.connect(db_path)
         # setup main tables
@@ -60,38 +83,400 @@ class SimpleVectorDB:
                     (TS, pa.timestamp("s", tz="UTC"))
                 ]), 
                 mode="overwrite"
-            ).create_scalar_index(id_key, replace=True)
+            )
+            db[table].create_scalar_index(id_key, replace=True)
+            db[table].create_scalar_index(TS, replace=True)
         # setup additonal tables
         for cls_name, cls_values in additional_tables.items():
             db.create_table(cls_name, data=cls_values, mode="overwrite")
-        return cls(db_path, table_id_keys=table_id_keys)
+        return cls(db_path, table_id_keys=table_id_keys, distance_func=distance_func)
 
-    def store(self, table: str, items: list[dict[str, Any]]):
-        if not items: return 0
+    def store(self, table: str, items: list[dict[str, Any]] = None, ids: list[str]|np.ndarray|pa.Array = None, embeddings: np.ndarray = None):
+        """Inserts rows whose ids do not exist yet and returns the number of inserted rows.
 
+        Parameters:
+            table: name of the table.
+            items: list of dicts with the id key and `embedding`. Each dict gets stamped with `ts`.
+            ids, embeddings: alternatively, the ids and a contiguous (n, VECTOR_LEN) float32 array. The array is wrapped
+                as an arrow FixedSizeListArray without copying or creating per-row python objects, and the caller's data is not mutated.
+        """
         id_key = self.id_keys[table]
-        result = self.db[table].merge_insert(id_key) \
+        if items: data = _prepare_to_store(items, id_key)
+        elif ids is not None and len(ids): data = _to_table(id_key, ids, embeddings, int(datetime.now(tz=timezone.utc).timestamp()))
+        else: return 0
+
+        tbl = self.db[table]
+        version = tbl.version
+        result = tbl.merge_insert(id_key) \
             .when_not_matched_insert_all() \
-                .execute(_prepare_to_store(items, id_key))
+                .execute(data)
+        flat = self._flat_tables.pop(table, None)
+        # fold the new rows into the brute-force engine instead of reloading the table on the next search,
+        # as long as the table stays small enough for it
+        if flat and flat.version == version and tbl.version == version + 1:
+            flat = flat.append(tbl.version, data if items is None else _to_arrow(items, id_key))
+            if flat.num_rows == tbl.count_rows() and flat.num_rows <= INDEXING_THRESHOLD: self._flat_tables[table] = flat
         return result.num_inserted_rows
         
-    def search(self, table: str, embedding: list[float], distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None):
+    def get(self, table: str, ids: list[str], columns: list[str] = None) -> pa.Table:
+        """Returns the rows of `table` with the given ids (in no particular order) using the scalar index on the id column."""
+        id_key = self.id_keys[table]
+        tbl = self.db[table]
+        batches = []
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            in_list = ", ".join("'" + id.replace("'", "''") + "'" for id in ids[start:start+LOOKUP_BATCH_SIZE])
+            batches.append(tbl.search().where(f"{id_key} IN ({in_list})").select(columns or [id_key, EMBEDDING, TS]).limit(None).to_arrow())
+        return pa.concat_tables(batches) if batches else tbl.schema.empty_table().select(columns or [id_key, EMBEDDING, TS])
+
+    def search(self, table: str, embedding: list[float], distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: datetime|timedelta = None, nprobes: Optional[int] = None, refine_factor: Optional[int] = None):
+        """Searches the nearest neighbors of `embedding` in `table`. 
+        Tables with ids below INDEXING_THRESHOLD rows are searched with an in-memory brute-force engine (see `_FlatTable`), 
+        larger tables and additional static tables go through LanceDB vector search. Both return the same rows and distances.
+        If `since` (a datetime or an age) is given, only rows stored after it are searched.
+        `nprobes` (IVF partitions to visit) and `refine_factor` (candidates re-ranked with full vectors) trade recall for latency 
+        on indexed tables and are ignored by the exact brute-force engine."""
+        flat = self._flat_table(table)
+        if flat: return flat.search(embedding, distance_func=distance_func, distance=distance, limit=limit, columns=columns, since=_epoch(since))
+        return self._lance_search(table, embedding, distance_func=distance_func, distance=distance, limit=limit, columns=columns, since=since, nprobes=nprobes, refine_factor=refine_factor)
+
+    def search_many(self, table: str, embeddings: np.ndarray, distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: datetime|timedelta = None, nprobes: Optional[int] = None, refine_factor: Optional[int] = None) -> pa.Table:
+        """Searches the nearest neighbors of every row of `embeddings` (a 2-D float32 array) in one batched query.
+        Returns a single arrow table with a `query_index` column pointing to the row of `embeddings` followed by the 
+        selected columns and `_distance`, sorted by query index and then distance. `distance` and `limit` apply per query."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        flat = self._flat_table(table)
+        if flat: return flat.search_many(embeddings, distance_func=distance_func, distance=distance, limit=limit, columns=columns, since=_epoch(since))
+        return self._lance_search_many(table, embeddings, distance_func=distance_func, distance=distance, limit=limit, columns=columns, since=since, nprobes=nprobes, refine_factor=refine_factor)
+
+    def _lance_search_many(self, table: str, embeddings: np.ndarray, distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: datetime|timedelta = None, nprobes: Optional[int] = None, refine_factor: Optional[int] = None) -> pa.Table:
+        query = self.db[table].search(list(embeddings), vector_column_name="embedding", query_type="vector").distance_type(distance_func)
+        if since: query = query.where(f"{TS} >= {_ts_expr(_epoch(since))}", prefilter=True)
+        if distance: query = query.distance_range(upper_bound = distance)
+        if nprobes: query = query.nprobes(nprobes)
+        if refine_factor: query = query.refine_factor(refine_factor)
+        if limit: query = query.limit(limit)
+        if columns: query = query.select(columns+["_distance"])
+        result = query.to_arrow()
+        # lancedb only adds the query index for more than one query
+        if QUERY_INDEX not in result.column_names: result = result.add_column(0, QUERY_INDEX, pa.array(np.zeros(len(result), dtype=np.int32)))
+        return result.sort_by([(QUERY_INDEX, "ascending"), (DISTANCE, "ascending")])
+
+    def _lance_search(self, table: str, embedding: list[float], distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: datetime|timedelta = None, nprobes: Optional[int] = None, refine_factor: Optional[int] = None):
         query = self.db[table].search(embedding, vector_column_name="embedding", query_type="vector").distance_type(distance_func)  
+        if since: query = query.where(f"{TS} >= {_ts_expr(_epoch(since))}", prefilter=True)
         if distance: query = query.distance_range(upper_bound = distance)
+        if nprobes: query = query.nprobes(nprobes)
+        if refine_factor: query = query.refine_factor(refine_factor)
         if limit: query = query.limit(limit)
         if columns: query = query.select(columns+["_distance"])
         return query.to_list()
+
+    def _flat_table(self, table: str):
+        """Returns the brute-force engine of `table` if it is small enough, loading or rebuilding it when the table changed."""
+        if table not in self.id_keys: return
+
+        tbl = self.db[table]
+        flat = self._flat_tables.get(table)
+        if flat and flat.version == tbl.version and flat.num_rows <= INDEXING_THRESHOLD: return flat
+
+        self._flat_tables.pop(table, None)
+        if tbl.count_rows() > INDEXING_THRESHOLD: return
+        flat = _FlatTable.load(self.flat_dir, table, self.id_keys[table], tbl.version) if self.flat_dir else None
+        if not flat:
+            flat = _FlatTable(tbl.version, self.id_keys[table], tbl.to_arrow())
+            if self.flat_dir: flat.save(self.flat_dir, table)
+        self._flat_tables[table] = flat
+        return flat
     
+    def expire(self, table: str, older_than: datetime|timedelta) -> int:
+        """Deletes the rows of `table` stored before `older_than` (a datetime or an age) and compacts the table afterwards.
+        The rows are removed with a single predicate delete on the indexed `ts` column, which Lance applies as one deletion 
+        vector per fragment in one commit. Returns the number of deleted rows."""
+        cutoff = _epoch(older_than)
+        where = f"{TS} < {_ts_expr(cutoff)}"
+        tbl = self.db[table]
+        count = tbl.count_rows(where)
+        if not count: return 0
+
+        version = tbl.version
+        tbl.delete(where)
+        tbl.compact_files()
+        flat = self._flat_tables.pop(table, None)
+        if flat and flat.version == version:
+            flat = flat.filter(tbl.version, flat.ts >= cutoff)
+            if flat.num_rows == tbl.count_rows(): self._flat_tables[table] = flat
+        return count
+
+    def index_stats(self, table: str) -> dict:
+        """Returns the row counts covered and not covered by the vector index of `table` along with the index type and distance type."""
+        tbl = self.db[table]
+        stats = tbl.index_stats(VECTOR_INDEX) if any(index.name == VECTOR_INDEX for index in tbl.list_indices()) else None
+        num_rows = tbl.count_rows()
+        return {
+            "num_rows": num_rows,
+            "num_indexed_rows": stats.num_indexed_rows if stats else 0,
+            "num_unindexed_rows": stats.num_unindexed_rows if stats else num_rows,
+            "index_type": stats.index_type if stats else None,
+            "distance_type": stats.distance_type if stats else None
+        }
+
     def optimize(self, **kwargs):
+        """Builds or refreshes the vector index of the id tables above INDEXING_THRESHOLD rows and compacts the large tables.
+        An index is (re)built when it is missing, was built for another distance function or index type, or the table has grown 
+        REINDEX_GROWTH times past the indexed rows. Otherwise new rows are folded into the existing index by `optimize`."""
         for tbl in self.db.table_names():
-            if self.db[tbl].count_rows() > INDEXING_THRESHOLD:
-                # self.db[tbl].create_index(metric="l2", vector_column_name="embedding", index_type="IVF_RQ", replace=True)
-                self.db[tbl].optimize(**kwargs)
+            stats = self.index_stats(tbl)
+            if stats["num_rows"] <= INDEXING_THRESHOLD: continue
+            if tbl in self.id_keys:
+                config = _index_config(stats["num_rows"], self.distance_func)
+                if stats["index_type"] != config["index_type"] or stats["distance_type"] != self.distance_func or stats["num_indexed_rows"] * REINDEX_GROWTH < stats["num_rows"]:
+                    self.db[tbl].create_index(vector_column_name=EMBEDDING, name=VECTOR_INDEX, replace=True, **config)
+            self.db[tbl].optimize(**kwargs)
+        # persist the in-memory engines so that the next process can memory-map them
+        if self.flat_dir:
+            for table, flat in self._flat_tables.items(): flat.save(self.flat_dir, table)
 
     def close(self):
         self.optimize()
+        self._flat_tables.clear()
         del self.db
 
+class EmbeddingCache:
+    """Embeddings keyed by the hash of the (whitespace and case normalized) text they were computed from,
+    stored in a SimpleVectorDB table so that the same text reaching us through another url or a re-crawl is not embedded again.
+    Hits are touched in one batched update on the next `put` and the least recently used entries are evicted past `max_items`."""
+    index: SimpleVectorDB
+    table: str
+    max_items: int
+    hits: int
+    misses: int
+
+    def __init__(self, index: SimpleVectorDB|str, table: str = "embedding_cache", max_items: int = EMBEDDING_CACHE_SIZE):
+        """
+        Parameters:
+            index: SimpleVectorDB or a path to open one at.
+            table: table in `index` holding the cached embeddings. Created when opening from a path.
+            max_items: number of entries kept after eviction.
+        """
+        if isinstance(index, str): index = SimpleVectorDB(index, {table: ID})
+        elif table not in index.id_keys: raise ValueError(f"{table} is not an id table of the index")
+        self.index = index
+        self.table = table
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._touched: set[str] = set()
+
+    def get(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Returns the cached embedding of each text or None where it is not cached."""
+        keys = [content_hash(text) for text in texts]
+        found = self.index.get(self.table, list(set(keys)), columns=[self.index.id_keys[self.table], EMBEDDING])
+        cached = dict(zip(found.column(0).to_pylist(), found[EMBEDDING].to_pylist()))
+        self._touched.update(cached)
+        embeddings = [cached.get(key) for key in keys]
+        self.hits += len(embeddings) - embeddings.count(None)
+        self.misses += embeddings.count(None)
+        return embeddings
+
+    def put(self, texts: list[str], embeddings: np.ndarray|list[list[float]]) -> int:
+        """Caches the embeddings of `texts` and evicts the least recently used entries if the cache is over `max_items`. 
+        Returns the number of new entries."""
+        if not texts: return 0
+        keys = {content_hash(text): i for i, text in enumerate(texts)}
+        count = self.index.store(self.table, ids=list(keys), embeddings=np.asarray(embeddings, dtype=np.float32)[list(keys.values())])
+        self.evict()
+        return count
+
+    def evict(self) -> int:
+        """Refreshes the timestamps of the entries read since the last call and deletes the oldest entries past `max_items`.
+        Returns the number of evicted entries."""
+        tbl = self.index.db[self.table]
+        id_key = self.index.id_keys[self.table]
+        in_lists = lambda keys: (", ".join(f"'{key}'" for key in keys[start:start+LOOKUP_BATCH_SIZE]) for start in range(0, len(keys), LOOKUP_BATCH_SIZE))
+        if self._touched:
+            keys, self._touched = list(self._touched), set()
+            for in_list in in_lists(keys): tbl.update(where=f"{id_key} IN ({in_list})", values={TS: datetime.now(tz=timezone.utc)})
+
+        excess = tbl.count_rows() - self.max_items
+        if excess <= 0: return 0
+        entries = tbl.to_lance().to_table(columns=[id_key, TS])
+        oldest = entries[id_key].take(pc.sort_indices(entries[TS])[:excess]).to_pylist()
+        for in_list in in_lists(oldest): tbl.delete(f"{id_key} IN ({in_list})")
+        return excess
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "num_items": self.index.db[self.table].count_rows(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class _FlatTable:
+    """Brute-force search engine for small tables.
+    Holds the embeddings as an L2-normalized float32 matrix along with their norms, ids and timestamps.
+    A search is a single BLAS matrix-vector product followed by an `argpartition` top-k.
+    The matrix is memory-mapped when loaded from disk."""
+    version: int
+    id_key: str
+    ids: np.ndarray
+    vectors: np.ndarray
+    norms: np.ndarray
+    ts: np.ndarray
+
+    def __init__(self, version: int, id_key: str, data: pa.Table = None, ids: np.ndarray = None, vectors: np.ndarray = None, norms: np.ndarray = None, ts: np.ndarray = None):
+        self.version = version
+        self.id_key = id_key
+        if data is None:
+            self.ids, self.vectors, self.norms, self.ts = ids, vectors, norms, ts
+            return
+
+        data = data.filter(pc.is_valid(data[EMBEDDING]))
+        embeddings = _to_matrix(data[EMBEDDING].combine_chunks())
+        self.norms = np.linalg.norm(embeddings, axis=1)
+        self.vectors = np.divide(embeddings, self.norms[:, None], out=np.zeros_like(embeddings), where=self.norms[:, None] > 0)
+        self.ids = np.asarray(data[id_key].to_numpy(zero_copy_only=False), dtype=str)
+        self.ts = data[TS].cast(pa.int64()).fill_null(0).to_numpy() if TS in data.column_names else np.zeros(len(self.ids), dtype=np.int64)
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.ids)
+
+    def append(self, version: int, data: pa.Table):
+        """Returns a new engine with rows of `data` whose ids are not in this one."""
+        new = _FlatTable(version, self.id_key, data)
+        _, first = np.unique(new.ids, return_index=True)
+        keep = np.sort(first[~np.isin(new.ids[first], self.ids)])
+        return _FlatTable(
+            version, self.id_key,
+            ids=np.concatenate([self.ids, new.ids[keep]]),
+            vectors=np.concatenate([self.vectors, new.vectors[keep]]),
+            norms=np.concatenate([self.norms, new.norms[keep]]),
+            ts=np.concatenate([self.ts, new.ts[keep]])
+        )
+
+    def filter(self, version: int, mask: np.ndarray):
+        return _FlatTable(version, self.id_key, ids=self.ids[mask], vectors=self.vectors[mask], norms=self.norms[mask], ts=self.ts[mask])
+
+    def distances(self, embeddings: np.ndarray, distance_func: DISTANCE_FUNC = "l2", since: int = None) -> np.ndarray:
+        """Computes the (num queries, num rows) distance matrix of a 2-D `embeddings` array with one matrix product.
+        Distances are the same as lancedb i.e. squared euclidean for l2, 1 - cosine similarity for cosine and 1 - inner product for dot.
+        Rows stored before `since` (epoch seconds) get an infinite distance."""
+        distances = self._distances(embeddings, distance_func)
+        if since: distances[:, self.ts < since] = np.inf
+        return distances
+
+    def _distances(self, embeddings: np.ndarray, distance_func: DISTANCE_FUNC) -> np.ndarray:
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        query_norms = np.linalg.norm(queries, axis=1)[:, None]
+        similarities = np.divide(queries, query_norms, out=np.zeros_like(queries), where=query_norms > 0) @ self.vectors.T
+        if distance_func == "cosine": return 1 - similarities
+        if distance_func == "dot": return 1 - similarities * self.norms * query_norms
+        return np.maximum(self.norms**2 + query_norms**2 - 2 * similarities * self.norms * query_norms, 0)
+
+    def search(self, embedding: list[float], distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: int = None):
+        return self._take(*self._top_k(self.distances(embedding, distance_func, since)[0], distance, limit), columns).to_pylist()
+
+    def search_many(self, embeddings: np.ndarray, distance_func: DISTANCE_FUNC = "l2", distance: Optional[float] = None, limit: Optional[int] = None, columns: list[str] = None, since: int = None) -> pa.Table:
+        limit = min(limit or DEFAULT_LIMIT, self.num_rows)
+        chunk_size = max(MAX_DISTANCE_MATRIX // max(self.num_rows, 1), 1)
+        query_indices, indices, distances = [], [], []
+        for start in range(0, len(embeddings), chunk_size):
+            chunk = self.distances(embeddings[start:start+chunk_size], distance_func, since)
+            # top-k of every query in one pass; the distance bound is applied after since it does not change the order
+            top = np.argpartition(chunk, limit - 1, axis=1)[:, :limit] if 0 < limit < self.num_rows else np.broadcast_to(np.arange(self.num_rows), (len(chunk), self.num_rows))
+            top_distances = np.take_along_axis(chunk, top, axis=1)
+            order = np.argsort(top_distances, axis=1, kind="stable")
+            top, top_distances = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+            keep = (top_distances < distance) if distance else np.isfinite(top_distances)
+            query_indices.append(np.nonzero(keep)[0] + start)
+            indices.append(top[keep])
+            distances.append(top_distances[keep])
+        
+        if not query_indices: return self._take(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), columns, np.empty(0, dtype=np.int32))
+        return self._take(np.concatenate(indices), np.concatenate(distances), columns, np.concatenate(query_indices))
+
+    def _top_k(self, distances: np.ndarray, distance: Optional[float] = None, limit: Optional[int] = None):
+        indices = np.flatnonzero(distances < distance) if distance else np.flatnonzero(np.isfinite(distances))
+        limit = limit or DEFAULT_LIMIT
+        if len(indices) > limit: 
+            indices = indices[np.argpartition(distances[indices], limit - 1)[:limit]]
+        indices = indices[np.argsort(distances[indices], kind="stable")]
+        return indices, distances[indices]
+
+    def _take(self, indices: np.ndarray, distances: np.ndarray, columns: list[str] = None, query_indices: np.ndarray = None) -> pa.Table:
+        fields = ([QUERY_INDEX] if query_indices is not None else []) + (columns or [self.id_key, EMBEDDING, TS]) + [DISTANCE]
+        values = {
+            QUERY_INDEX: lambda: pa.array(query_indices, type=pa.int32()),
+            self.id_key: lambda: pa.array(self.ids[indices], type=pa.string()),
+            EMBEDDING: lambda: _to_fixed_size_list(self.vectors[indices] * self.norms[indices, None]),
+            TS: lambda: pa.array(self.ts[indices], type=pa.int64()).cast(pa.timestamp("s", tz="UTC")),
+            DISTANCE: lambda: pa.array(distances, type=pa.float32())
+        }
+        return pa.table({field: values[field]() for field in fields})
+
+    def save(self, flat_dir: str, table: str):
+        """Writes the engine as `{table}-{version}.npy` (matrix) and `{table}-{version}.npz` (ids, norms, timestamps) and removes older versions."""
+        os.makedirs(flat_dir, exist_ok=True)
+        prefix = os.path.join(flat_dir, f"{table}-{self.version}")
+        if os.path.exists(prefix+".npz"): return
+        np.save(prefix+".npy", np.ascontiguousarray(self.vectors, dtype=np.float32))
+        np.savez(prefix+".npz", ids=self.ids, norms=self.norms, ts=self.ts)
+        for path in glob.glob(os.path.join(flat_dir, f"{glob.escape(table)}-*.np[yz]")):
+            if not path.startswith(prefix+"."): os.remove(path)
+
+    @classmethod
+    def load(cls, flat_dir: str, table: str, id_key: str, version: int):
+        prefix = os.path.join(flat_dir, f"{table}-{version}")
+        if not os.path.exists(prefix+".npz"): return
+        with np.load(prefix+".npz") as meta:
+            return cls(version, id_key, ids=meta["ids"], vectors=np.load(prefix+".npy", mmap_mode="r"), norms=meta["norms"], ts=meta["ts"])
+
+def _index_config(num_rows: int, distance_func: DISTANCE_FUNC) -> dict:
+    """Picks the vector index type and parameters for a table of `num_rows` rows searched with `distance_func`.
+    Tables up to HNSW_THRESHOLD rows get a single-partition IVF_HNSW_SQ index, which keeps recall high without tuning. 
+    Larger tables get an IVF index with ~PARTITION_SIZE rows per partition: RaBitQ for cosine since it quantizes normalized 
+    vectors well, product quantization for l2 and dot."""
+    if num_rows <= HNSW_THRESHOLD:
+        return {"metric": distance_func, "index_type": "IVF_HNSW_SQ", "num_partitions": 1}
+    config = {"metric": distance_func, "num_partitions": num_rows // PARTITION_SIZE}
+    if distance_func == "cosine": return config | {"index_type": "IVF_RQ"}
+    return config | {"index_type": "IVF_PQ", "num_sub_vectors": VECTOR_LEN // 16}
+
+def _epoch(value: datetime|timedelta) -> int:
+    """Converts a datetime or an age (relative to now) into epoch seconds. Naive datetimes are treated as UTC."""
+    if value is None: return None
+    if isinstance(value, timedelta): value = datetime.now(tz=timezone.utc) - value
+    if not value.tzinfo: value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+_ts_expr = lambda seconds: f"timestamp '{datetime.fromtimestamp(seconds, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}'"
+
+def _to_matrix(embeddings: pa.FixedSizeListArray) -> np.ndarray:
+    """Zero-copy view of a fixed size list array as a (n, VECTOR_LEN) float32 matrix."""
+    values = embeddings.flatten().to_numpy(zero_copy_only=False)
+    return np.asarray(values, dtype=np.float32).reshape(-1, embeddings.type.list_size)
+
+def _to_fixed_size_list(matrix: np.ndarray) -> pa.FixedSizeListArray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    return pa.FixedSizeListArray.from_arrays(pa.array(matrix.reshape(-1)), matrix.shape[1] if matrix.ndim == 2 else VECTOR_LEN)
+
+def _to_arrow(items: list[dict[str, Any]], id_key: str) -> pa.Table:
+    return _to_table(id_key, [item[id_key] for item in items], np.asarray([item[EMBEDDING] for item in items], dtype=np.float32), items[0][TS])
+
+def _to_table(id_key: str, ids: list[str]|np.ndarray|pa.Array, embeddings: np.ndarray, ts: int) -> pa.Table:
+    """Builds a table in the storage schema from ids, a (n, VECTOR_LEN) float32 matrix and a single timestamp (epoch seconds)."""
+    embeddings = np.asarray(embeddings)
+    if embeddings.ndim != 2 or embeddings.shape != (len(ids), VECTOR_LEN):
+        raise ValueError(f"embeddings should be a ({len(ids)}, {VECTOR_LEN}) array, got {embeddings.shape}")
+    return pa.table({
+        id_key: ids if isinstance(ids, pa.Array) else pa.array(ids, type=pa.string()),
+        EMBEDDING: _to_fixed_size_list(embeddings),
+        TS: pa.array(np.full(len(ids), ts, dtype=np.int64)).cast(pa.timestamp("s", tz="UTC"))
+    })
+
 def _prepare_to_store(items: list[dict[str, Any]], id_key: str):
     """attaches timestamps"""
     ts = int(datetime.now(tz=timezone.utc).timestamp())
@@ -0,0 +1,189 @@
+"""Micro-benchmarks for pybeansack hot paths, skipped unless selected with `-m benchmark` or BENCH=1.
+
+    pytest pybeansack/tests/bench_test.py -m benchmark -s
+"""
+
+import sys
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pytest
+from icecream import ic
+
+from pybeansack import ducksack, lancesack
+from pybeansack.database import BEANS
+from pybeansack.models import *
+from pybeansack.simplevectordb import EMBEDDING, TS, SimpleVectorDB
+from pybeansack.utils import VECTOR_LEN
+
+BENCH_ROUNDS = int(os.getenv("BENCH_ROUNDS", 5))
+
+# the seeds run into minutes, so a plain `pytest tests` must not pick these up
+pytestmark = pytest.mark.skipif(
+    "not os.getenv('BENCH') and 'benchmark' not in config.getoption('markexpr')",
+    reason="benchmarks run only with -m benchmark or BENCH=1",
+)
+
+
+def _timeit(func, rounds: int = BENCH_ROUNDS) -> float:
+    """Returns the best wall time in milliseconds over `rounds` runs."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _seed_lance_beans(db: lancesack.LanceSack, num_rows: int, batch_size: int = 100_000):
+    tbl = db.db[BEANS]
+    for start in range(0, num_rows, batch_size):
+        urls = [f"https://example.com/{i}" for i in range(start, min(start + batch_size, num_rows))]
+        tbl.add(pa.table({K_URL: urls}).cast(pa.schema([tbl.schema.field(K_URL)])), mode="append")
+    tbl.create_scalar_index(K_URL, index_type="BTREE", replace=True)
+
+
+@pytest.mark.benchmark
+@pytest.mark.lance
+@pytest.mark.parametrize("num_rows", [10_000, 100_000, 1_000_000])
+def test_lance_deduplicate(num_rows):
+    with tempfile.TemporaryDirectory() as path:
+        db = lancesack.create_db(path)
+        _seed_lance_beans(db, num_rows)
+        # half of the candidates exist, half are new
+        candidates = [Bean(url=f"https://example.com/{i}") for i in range(num_rows - 500, num_rows + 500)]
+        assert len(db.deduplicate(BEANS, candidates)) == 500
+        ic(num_rows, _timeit(lambda: db.deduplicate(BEANS, candidates)))
+
+
+def _seed_duck_beans(db: ducksack.DuckSack, num_rows: int, batch_size: int = 50_000):
+    rng = np.random.default_rng(0)
+    created = datetime.now()
+    for start in range(0, num_rows, batch_size):
+        count = min(batch_size, num_rows - start)
+        vectors = rng.random((count, VECTOR_LEN), dtype=np.float32)
+        db.store_beans([
+            Bean(url=f"https://example.com/{i}", kind=NEWS if i % 2 else BLOG, source=f"source-{i % 100}", title=f"title {i}", created=created, collected=created, embedding=vector.tolist())
+            for i, vector in zip(range(start, start + count), vectors)
+        ])
+
+
+@pytest.mark.benchmark
+@pytest.mark.duck
+@pytest.mark.parametrize("num_rows", [10_000, 100_000])
+def test_duck_embedding_layouts(num_rows):
+    """Non-vector scans and vector queries over beans with inline embeddings and with the bean_embeddings side table."""
+    with tempfile.TemporaryDirectory() as path:
+        db = ducksack.create_db(db_path=os.path.join(path, "beans.duckdb"))
+        _seed_duck_beans(db, num_rows)
+        query = np.random.random(VECTOR_LEN).astype(np.float32).tolist()
+        for split in (False, True):
+            db.migrate_embeddings(split=split)
+            ic(
+                num_rows, split,
+                _timeit(lambda: db.query_latest_beans(sources=["source-1", "source-2"], limit=100)),
+                _timeit(lambda: db.count_rows(BEANS, conditions=["title LIKE '%9%'"])),
+                _timeit(lambda: db.query_latest_beans(embedding=query, limit=10)),
+            )
+        db.close()
+
+
+@pytest.mark.benchmark
+@pytest.mark.duck
+@pytest.mark.parametrize("num_rows", [10_000, 100_000])
+def test_duck_quantized_embeddings(num_rows):
+    """Exact vector queries against the binary-code first pass with float re-rank, and recall@10 of the latter."""
+    with tempfile.TemporaryDirectory() as path:
+        db = ducksack.create_db(db_path=os.path.join(path, "beans.duckdb"))
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(num_rows // 100, VECTOR_LEN)).astype(np.float32)
+        created = datetime.now()
+        for start in range(0, num_rows, 50_000):
+            count = min(50_000, num_rows - start)
+            # clustered, zero-centred vectors so that the sign bits carry information, like real text embeddings
+            vectors = centers[rng.integers(0, len(centers), count)] + rng.normal(scale=0.1, size=(count, VECTOR_LEN)).astype(np.float32)
+            db.store_beans([
+                Bean(url=f"https://example.com/{i}", kind=NEWS, title=f"title {i}", created=created, collected=created, embedding=vector.tolist())
+                for i, vector in zip(range(start, start + count), vectors)
+            ])
+        query = (centers[0] + rng.normal(scale=0.1, size=VECTOR_LEN)).tolist()
+        search = lambda: {bean.url for bean in db.query_latest_beans(embedding=query, limit=10, columns=[K_URL, K_CREATED])}
+        exact = search()
+        exact_ms = _timeit(search)
+        db.quantize_embeddings("bit")
+        recall = len(search() & exact) / len(exact)
+        ic(num_rows, exact_ms, _timeit(search), recall)
+        db.close()
+
+
+def _seed_vectordb(db: SimpleVectorDB, table: str, num_rows: int, batch_size: int = 100_000):
+    rng = np.random.default_rng(0)
+    for start in range(0, num_rows, batch_size):
+        count = min(batch_size, num_rows - start)
+        vectors = rng.random((count, VECTOR_LEN), dtype=np.float32)
+        db.db[table].add(pa.table({
+            "id": [f"item-{i}" for i in range(start, start + count)],
+            EMBEDDING: pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), VECTOR_LEN),
+            TS: pa.array(np.zeros(count, dtype=np.int64)).cast(pa.timestamp("s", tz="UTC")),
+        }))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("num_rows", [1_000, 10_000, 100_000])
+def test_vectordb_search(num_rows):
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB.create_db(path, {"items": "id"})
+        _seed_vectordb(db, "items", num_rows)
+        query = np.random.random(VECTOR_LEN).astype(np.float32).tolist()
+        db.search("items", query)  # loads the brute-force engine
+        ic(
+            num_rows,
+            _timeit(lambda: db.search("items", query, distance_func="cosine", limit=10, columns=["id"])),
+            _timeit(lambda: db._lance_search("items", query, distance_func="cosine", limit=10, columns=["id"])),
+        )
+        db.close()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("num_rows", [10_000, 200_000])
+def test_vectordb_search_many(num_rows):
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB.create_db(path, {"items": "id"})
+        _seed_vectordb(db, "items", num_rows)
+        queries = np.random.random((64, VECTOR_LEN)).astype(np.float32)
+        db.search("items", queries[0].tolist())
+        ic(
+            num_rows,
+            _timeit(lambda: db.search_many("items", queries, distance_func="cosine", limit=5, columns=["id"]), rounds=2),
+            _timeit(lambda: [db.search("items", query.tolist(), distance_func="cosine", limit=5, columns=["id"]) for query in queries], rounds=2),
+        )
+        db.close()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("num_rows", [10_000, 100_000])
+def test_vectordb_store(num_rows):
+    vectors = np.random.random((num_rows, VECTOR_LEN)).astype(np.float32)
+    ids = [f"item-{i}" for i in range(num_rows)]
+
+    def store(as_matrix: bool):
+        with tempfile.TemporaryDirectory() as path:
+            db = SimpleVectorDB.create_db(path, {"items": "id"})
+            if as_matrix: assert db.store("items", ids=ids, embeddings=vectors) == num_rows
+            else: assert db.store("items", [{"id": id, EMBEDDING: vector.tolist()} for id, vector in zip(ids, vectors)]) == num_rows
+
+    ic(num_rows, _timeit(lambda: store(True), rounds=2), _timeit(lambda: store(False), rounds=2))
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([str(Path(__file__).resolve()), "-m", "benchmark", "-s", *sys.argv[1:]]))
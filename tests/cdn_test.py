@@ -0,0 +1,99 @@
+"""Tests for the CDN stores against the local filesystem backend (run via pytest)."""
+
+import sys
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+import asyncio
+import gzip
+import io
+import os
+
+import pytest
+from icecream import ic
+
+from pybeansack.cdnstore import AsyncLocalCDNStore, LocalCDNStore
+
+
+def test_local_store(tmp_path):
+    store = LocalCDNStore(str(tmp_path / "cdn"), "https://cdn.example.com", compression="gzip", compression_threshold=16)
+    content = "<p>hello</p>" * 100
+    assert store.upload_text("digests/a.html", content, skip_unchanged=True) == "https://cdn.example.com/digests/a.html"
+    store.upload_text("digests/a.html", content, skip_unchanged=True)
+    assert store.stats == {"uploaded": 1, "skipped": 1}
+    assert gzip.decompress((tmp_path / "cdn" / "digests" / "a.html").read_bytes()).decode() == content
+
+    data = os.urandom(11 << 20)
+    store.upload_stream("files/big.bin", io.BytesIO(data), part_size=5 << 20)
+    assert (tmp_path / "cdn" / "files" / "big.bin").read_bytes() == data
+
+    for key in (".cdnmeta/uploads/x", "files/../.cdnmeta/digests/a.html.json", "../outside.html"):
+        with pytest.raises(ValueError): store.upload_text(key, content)
+
+
+def test_local_manifest(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    content = "<p>hello</p>" * 100
+    with LocalCDNStore(str(tmp_path / "cdn"), manifest_path=manifest_path) as store:
+        store.upload_text("digests/a.html", content, skip_unchanged=True)
+    # the manifest is saved on exit and answers the next run
+    with LocalCDNStore(str(tmp_path / "cdn"), manifest_path=manifest_path) as store:
+        store.upload_text("digests/a.html", content, skip_unchanged=True)
+        assert store.stats == {"uploaded": 0, "skipped": 1}
+        # a binary write replaces the object, so the old text is no longer unchanged
+        store.upload_binary("digests/a.html", b"binary")
+        store.upload_text("digests/a.html", content, skip_unchanged=True)
+        assert store.stats == {"uploaded": 1, "skipped": 1}
+    # the same content stored with a different encoding is uploaded again
+    with LocalCDNStore(str(tmp_path / "cdn"), manifest_path=manifest_path, compression="gzip", compression_threshold=16) as store:
+        store.upload_text("digests/a.html", content, skip_unchanged=True)
+        assert store.stats == {"uploaded": 1, "skipped": 0}
+    assert gzip.decompress((tmp_path / "cdn" / "digests" / "a.html").read_bytes()).decode() == content
+
+
+def test_local_upload_pipeline(tmp_path):
+    async def run():
+        async with AsyncLocalCDNStore(str(tmp_path / "cdn"), manifest_path=str(tmp_path / "manifest.json")) as store:
+            pipeline = store.upload_pipeline(((f"pages/{i}.html", f"page {i}") for i in range(500)), max_in_flight=16, skip_unchanged=True)
+            results = [result async for result in pipeline]
+            ic(pipeline.stats)
+            return results, store.stats
+
+    results, stats = asyncio.run(run())
+    assert len(results) == 500 and not any(result.error for result in results)
+    assert stats == {"uploaded": 500, "skipped": 0}
+    # the second cycle is answered from the manifest
+    results, stats = asyncio.run(run())
+    assert stats == {"uploaded": 0, "skipped": 500}
+
+
+def test_local_async_stream(tmp_path):
+    data = os.urandom(11 << 20)
+
+    async def run():
+        async with AsyncLocalCDNStore(str(tmp_path / "cdn")) as store:
+            # sync file objects are read off the event loop
+            await store.upload_stream("files/big.bin", io.BytesIO(data), part_size=5 << 20)
+
+    asyncio.run(run())
+    assert (tmp_path / "cdn" / "files" / "big.bin").read_bytes() == data
+
+    async def broken():
+        yield data
+        raise IOError("stream broke")
+
+    async def abort():
+        async with AsyncLocalCDNStore(str(tmp_path / "cdn")) as store:
+            # the parts in flight are awaited before the upload is aborted, so none are left behind
+            with pytest.raises(IOError): await store.upload_stream("files/broken.bin", broken(), part_size=5 << 20)
+
+    asyncio.run(abort())
+    assert not os.listdir(tmp_path / "cdn" / ".cdnmeta" / "uploads")
+    assert not (tmp_path / "cdn" / "files" / "broken.bin").exists()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([str(Path(__file__).resolve()), *sys.argv[1:]]))
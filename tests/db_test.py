@@ -15,7 +15,7 @@ import pytest
 from faker import Faker
 from icecream import ic
 
-from pybeansack.database import BEANS, CHATTERS, PUBLISHERS
+from pybeansack.database import BEANS, CHATTERS, PUBLISHERS, RELATED_BEANS, Estimate, NearDuplicateGate
 from pybeansack.models import *
 from pybeansack.utils import VECTOR_LEN, ndays_ago
 
@@ -163,6 +163,14 @@ def _trend_queries(db):
     )
 
 
+def _distinct(db):
+    ic(db.distinct_categories(limit=5))
+    ic(db.distinct_sentiments(limit=5))
+    ic(db.distinct_entities(limit=5, offset=5))
+    ic(db.distinct_regions(limit=5))
+    ic(db.distinct_publishers(limit=5))
+
+
 def _deduplicate(db):
     beans = generate_fake_beans(limit=5)
     beans[0].url = "https://example.com/article-1"
@@ -170,6 +178,133 @@ def _deduplicate(db):
     ic(len(beans), len(db.deduplicate(BEANS, beans)))
 
 
+def _store_unique_beans(db, gate_path):
+    # a bean exactly at eps is not a duplicate, whether it matches the index or the same batch
+    boundary = NearDuplicateGate(str(gate_path / "boundary"), eps=1.0)
+    first, second = (Bean(url=f"https://example.com/boundary-{i}", embedding=[float(i)] + [0.0] * (VECTOR_LEN - 1)) for i in range(2))
+    assert len(boundary.split([first, second])[0]) == 2
+    boundary.add([first])
+    assert len(boundary.split([second])[0]) == 1
+
+    gate = NearDuplicateGate(str(gate_path / "recent"))
+    beans = generate_fake_beans(ai_fields=True, limit=15)
+    syndicated = beans[0].model_copy(update={K_URL: faker.url() + "syndicated", K_EMBEDDING: (np.array(beans[0].embedding) + 0.001).tolist()})
+    ic(db.count_rows(RELATED_BEANS))
+    ic(db.store_unique_beans(beans + [syndicated], gate))
+    ic(db.count_rows(RELATED_BEANS))
+    # a bean crawled again is not a duplicate of itself
+    assert gate.split([beans[1]]) == ([beans[1]], [])
+    assert db.store_unique_beans([beans[1], beans[1]], gate)[1] == 0
+
+
+def _search_beans(db):
+    beans = generate_fake_beans(ai_fields=True, limit=15)
+    ic(db.store_beans(beans))
+    text = " ".join(beans[0].title.split()[:2])
+    ic(text, db.search_beans(text=text, embedding=beans[0].embedding, limit=5, columns=[K_URL, K_TITLE]))
+    ic(db.search_beans(text=text, kind=beans[0].kind, limit=5, columns=[K_URL, K_TITLE]))
+    ic(db.search_beans(embedding=beans[1].embedding, text_weight=0.2, limit=5, offset=1, columns=[K_URL, K_TITLE]))
+    ic(db.query_latest_beans(text=text, limit=5))
+
+
+def _projections(db):
+    ic(db.store_beans(generate_fake_beans(ai_fields=True, limit=15)))
+    beans = db.query_latest_beans(limit=5)
+    assert beans and not any(bean.content or bean.embedding for bean in beans)
+    db.load_fields(beans)
+    assert all(bean.content for bean in beans)
+    ic(db.query_latest_beans(limit=2, columns="digest"))
+    ic(db.search_beans(embedding=beans[0].embedding, limit=2, columns="full"))
+
+def _suggest(db):
+    beans = generate_fake_beans(ai_fields=True, limit=15)
+    ic(db.store_beans(beans))
+    ic(db.optimize())
+    ic(db.suggest(beans[0].entities[0][:3]))
+    ic(db.suggest(beans[0].regions[0].split()[-1][:4], kind=K_REGIONS, limit=3))
+    ic(db.suggest(beans[0].source[:2], kind=K_SOURCE))
+
+def _facet_counts(db):
+    beans = generate_fake_beans(ai_fields=True, limit=15)
+    ic(db.store_beans(beans))
+    ic(db.facet_counts())
+    ic(db.facet_counts([K_CATEGORIES, K_ENTITIES, K_SOURCE], limit=3, kind=beans[0].kind, created=ndays_ago(360)))
+    # callers get their own copy and writes drop the cached counts
+    counts = db.facet_counts([K_KIND], limit=0)
+    before = sum(counts[K_KIND].values())
+    counts[K_KIND].clear()
+    assert sum(db.facet_counts([K_KIND], limit=0)[K_KIND].values()) == before
+    stored = db.store_beans([bean.model_copy(update={K_URL: f"https://example.com/facets/{faker.uuid4()}"}) for bean in generate_fake_beans(ai_fields=True, limit=15)])
+    assert sum(db.facet_counts([K_KIND], limit=0)[K_KIND].values()) == before + stored
+
+
+def _approximate_counts(db):
+    beans = generate_fake_beans(ai_fields=True, limit=15)
+    ic(db.store_beans(beans))
+    ic(db.update_beans(beans[:5], columns=[K_TITLE]))
+    count, estimate = db.count_rows(BEANS), db.count_rows(BEANS, approximate=True)
+    ic(count, estimate)
+    assert isinstance(estimate, Estimate) and abs(estimate.value - count) <= estimate.value * estimate.error
+    ic(db.count_distinct(BEANS, K_ENTITIES), db.count_distinct(BEANS, K_ENTITIES, approximate=True))
+    ic(db.count_distinct(BEANS, K_SOURCE, approximate=True))
+
+
+def _split_embeddings(db):
+    ic(db.store_beans(generate_fake_beans(ai_fields=True, limit=15)))
+    moved = ic(db.migrate_embeddings(split=True))
+    try:
+        beans = generate_fake_beans(ai_fields=True, limit=15)
+        ic(db.store_beans(beans))
+        assert all(bean.embedding for bean in db.query_latest_beans(limit=5, columns="full"))
+        ic(db.query_latest_beans(embedding=beans[0].embedding, distance=0.5, limit=3, columns=[K_URL, K_TITLE, K_CREATED]))
+        ic(db.query_aggregated_beans(embedding=beans[0].embedding, limit=3, columns=[K_URL, K_TITLE, K_CREATED]))
+        ic(db.search_beans(text=beans[0].title, embedding=beans[0].embedding, limit=3, columns="full")[0].url == beans[0].url)
+        ic(db.update_beans([bean.model_copy(update={K_EMBEDDING: random_embedding()}) for bean in beans[:3]], columns=[K_EMBEDDING]))
+        ic(db.load_fields(db.query_latest_beans(limit=3)))
+    finally:
+        # every embedding moved out comes back along with those stored in the split layout
+        assert ic(db.migrate_embeddings(split=False)) >= moved > 0
+    assert all(bean.embedding for bean in db.load_fields([Bean(url=bean.url) for bean in beans], [K_EMBEDDING]))
+
+
+
+def _quantized_embeddings(db):
+    db.quantize_embeddings("bit")
+    try:
+        # binary codes keep the sign of each dimension, so they need centered embeddings like those of real models
+        # fresh urls, since store_beans skips urls that earlier tests may have stored with other embeddings
+        beans = [bean.model_copy(update={K_URL: f"https://example.com/quantized/{faker.uuid4()}", K_EMBEDDING: np.random.normal(size=VECTOR_LEN).tolist()}) for bean in generate_fake_beans(ai_fields=True, limit=15)]
+        ic(db.store_beans(beans))
+        query = (np.array(beans[0].embedding) + 0.01).tolist()
+        assert db.query_latest_beans(embedding=query, limit=3, columns=[K_URL, K_CREATED])[0].url == beans[0].url
+        assert db.search_beans(embedding=query, limit=3)[0].url == beans[0].url
+        ic(db.update_beans([beans[1].model_copy(update={K_EMBEDDING: query})], columns=[K_EMBEDDING]))
+        ic(db.search_beans(embedding=query, limit=3, columns=[K_URL]))
+    finally:
+        db.quantize_embeddings(None)
+
+
+def _split_quantized_embeddings(db):
+    db.migrate_embeddings(split=True)
+    db.quantize_embeddings("bit")
+    try:
+        beans = [bean.model_copy(update={K_URL: f"https://example.com/split-quantized/{faker.uuid4()}", K_EMBEDDING: np.random.normal(size=VECTOR_LEN).tolist()}) for bean in generate_fake_beans(ai_fields=True, limit=15)]
+        # beans without embeddings have no row in the side table and can never be vector matches
+        unembedded = [bean.model_copy(update={K_URL: f"https://example.com/split-quantized/{faker.uuid4()}", K_EMBEDDING: None}) for bean in generate_fake_beans(ai_fields=True, limit=15)]
+        ic(db.store_beans(beans + unembedded))
+        query = (np.array(beans[0].embedding) + 0.01).tolist()
+        unembedded_urls = {bean.url for bean in unembedded}
+        latest = db.query_latest_beans(embedding=query, limit=5, columns=[K_URL, K_CREATED])
+        assert latest[0].url == beans[0].url
+        assert not unembedded_urls & {bean.url for bean in latest}
+        searched = db.search_beans(embedding=query, limit=5)
+        assert searched[0].url == beans[0].url
+        assert not unembedded_urls & {bean.url for bean in searched}
+    finally:
+        db.quantize_embeddings(None)
+        db.migrate_embeddings(split=False)
+
+
 @pytest.mark.integration
 @pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
 def test_store_and_query(db):
@@ -182,6 +317,56 @@ def test_trend_queries(db):
     _trend_queries(db)
 
 
+@pytest.mark.integration
+@pytest.mark.parametrize("db", SQL_BACKENDS, indirect=True)
+def test_store_unique_beans(db, tmp_path):
+    _store_unique_beans(db, tmp_path / "gate")
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
+def test_search_beans(db):
+    _search_beans(db)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
+def test_projections(db):
+    _projections(db)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", SQL_BACKENDS, indirect=True)
+def test_split_embeddings(db):
+    _split_embeddings(db)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", SQL_BACKENDS, indirect=True)
+def test_quantized_embeddings(db):
+    _quantized_embeddings(db)
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
+def test_suggest(db):
+    _suggest(db)
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
+def test_facet_counts(db):
+    _facet_counts(db)
+
+@pytest.mark.integration
+@pytest.mark.parametrize("db", ALL_BACKENDS, indirect=True)
+def test_approximate_counts(db):
+    _approximate_counts(db)
+
+@pytest.mark.integration
+@pytest.mark.lance
+def test_distinct(lance_db):
+    _distinct(lance_db)
+
+
 @pytest.mark.integration
 @pytest.mark.pg
 def test_updates(pg_db):
@@ -194,5 +379,11 @@ def test_deduplicate(pg_db):
     _deduplicate(pg_db)
 
 
+@pytest.mark.integration
+@pytest.mark.pg
+def test_split_quantized_embeddings(pg_db):
+    _split_quantized_embeddings(pg_db)
+
+
 if __name__ == "__main__":
     raise SystemExit(pytest.main([str(Path(__file__).resolve().parent), *sys.argv[1:]]))
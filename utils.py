@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 import random
@@ -11,4 +12,6 @@ now = lambda: datetime.now(timezone.utc)
 ndays_ago = lambda ndays: now() - timedelta(days=ndays)
 ndays_ago_str = lambda ndays: ndays_ago(ndays).strftime('%Y-%m-%d')
 # random_filename = lambda prefix: re.sub(r'[^a-zA-Z0-9]', '-', prefix or "file")+f"-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S.%f')}-{random.randint(1000, 9999)}"
+# key for content that should embed the same regardless of whitespace and case
+content_hash = lambda text: hashlib.blake2b(" ".join(text.split()).casefold().encode("utf-8"), digest_size=16).hexdigest()
 non_null_fields = lambda items: list(set().union(*[[k for k, v in item.items() if v is not None] for item in items]))